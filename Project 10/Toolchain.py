@@ -0,0 +1,148 @@
+"""In-process build driver: Jack -> VM -> ASM -> Hack.
+
+The stages are imported as libraries and hand in-memory streams to each
+other, so a build starts one interpreter and writes no intermediate files:
+    analyze    Project 10's JackAnalyzer parses every .jack file (a syntax
+               check; --xml also writes the parse trees)
+    translate  Project 8's VM translator turns the .vm files into one
+               assembly program
+    assemble   Project 6's assembler encodes that program into the ROM
+
+This repository has no Jack-to-VM code generator (Project 11), so the .vm
+files are expected next to the .jack files, as the course's JackCompiler
+writes them.
+"""
+import io
+import os
+import sys
+import time
+import typing
+import argparse
+import importlib
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_stage(project: str, module_name: str) -> types.ModuleType:
+    """Imports a module of one of the projects.
+
+    The projects reuse module names (Main, Parser), so each project's
+    modules are dropped from sys.modules again once loaded; the stage keeps
+    its own references to them.
+
+    Args:
+        project (str): the project directory, e.g. "Project 8".
+        module_name (str): the module to import from it.
+
+    Returns:
+        types.ModuleType: the module.
+    """
+    directory = os.path.join(ROOT, project)
+    before = set(sys.modules)
+    sys.path.insert(0, directory)
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        sys.path.remove(directory)
+        for name in set(sys.modules) - before:
+            file_name = getattr(sys.modules[name], "__file__", None)
+            if file_name and os.path.dirname(os.path.abspath(file_name)) == directory:
+                del sys.modules[name]
+
+
+def files_with_extension(directory: str, extension: str) -> typing.List[str]:
+    return sorted(os.path.join(directory, file_name)
+                  for file_name in os.listdir(directory)
+                  if os.path.splitext(file_name)[1].lower() == extension)
+
+
+def analyze(jack_paths: typing.List[str], write_xml: bool) -> None:
+    """Runs the Jack analyzer over every file, writing the XML only if
+    asked to."""
+    analyzer = load_stage("Project 10", "JackAnalyzer")
+    for jack_path in jack_paths:
+        xml = io.StringIO()
+        with open(jack_path, 'r') as input_file:
+            analyzer.analyze_file(input_file, xml)
+        if write_xml:
+            with open(os.path.splitext(jack_path)[0] + ".xml", 'w') as xml_file:
+                xml_file.write(xml.getvalue())
+
+
+def translate(vm_paths: typing.List[str]) -> str:
+    """Translates the .vm files, in order, into one assembly program."""
+    translator = load_stage("Project 8", "Main")
+    asm = io.StringIO()
+    for i, vm_path in enumerate(vm_paths):
+        with open(vm_path, 'r') as input_file:
+            translator.translate_file(input_file, asm, i == 0)
+    return asm.getvalue()
+
+
+def assemble(asm: str) -> typing.List[str]:
+    """Assembles a program, returning its binary words."""
+    assembler = load_stage("Project 6", "Main")
+    _, words = assembler.assemble_parser(
+        assembler.Parser(lines=asm.splitlines()))
+    return words
+
+
+def build(directory: str, write_xml: bool = False,
+          write_asm: bool = False) -> typing.Dict[str, float]:
+    """Builds the program in a directory into <directory>/<name>.hack.
+
+    Args:
+        directory (str): a directory of .jack classes and their .vm files.
+        write_xml (bool): also write each class's XML parse tree.
+        write_asm (bool): also write the intermediate <name>.asm.
+
+    Returns:
+        typing.Dict[str, float]: seconds spent in each stage.
+    """
+    vm_paths = files_with_extension(directory, ".vm")
+    if not vm_paths:
+        raise ValueError(f"No .vm files in {directory}: compile the .jack "
+                         f"classes with a JackCompiler first")
+    output_path = os.path.join(directory, os.path.basename(directory))
+    timings = {}
+
+    start = time.perf_counter()
+    analyze(files_with_extension(directory, ".jack"), write_xml)
+    timings["analyze"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asm = translate(vm_paths)
+    timings["translate"] = time.perf_counter() - start
+    if write_asm:
+        with open(output_path + ".asm", 'w') as asm_file:
+            asm_file.write(asm)
+
+    start = time.perf_counter()
+    words = assemble(asm)
+    timings["assemble"] = time.perf_counter() - start
+
+    with open(output_path + ".hack", 'w') as hack_file:
+        hack_file.write("\n".join(words))
+    return timings
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="Toolchain", usage="Toolchain <directory> [options]")
+    arg_parser.add_argument("directory",
+                            help="a directory of .jack classes and their .vm files")
+    arg_parser.add_argument("--xml", action="store_true",
+                            help="also write the XML parse tree of every class")
+    arg_parser.add_argument("--asm", action="store_true",
+                            help="also write the intermediate .asm")
+    args = arg_parser.parse_args()
+
+    try:
+        stage_timings = build(os.path.abspath(args.directory), args.xml, args.asm)
+    except ValueError as error:
+        sys.exit(str(error))
+    for stage, seconds in stage_timings.items():
+        print(f"{stage:>9}: {seconds * 1000:8.1f} ms", file=sys.stderr)
+    print(f"{'total':>9}: {sum(stage_timings.values()) * 1000:8.1f} ms",
+          file=sys.stderr)
@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+
+CACHE_VERSION = 2
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_hash(file_name):
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, "rb") as file:
+        return content_hash(file.read())
+
+
+def split_regions(instructions):
+    # Content-defined regions: a new region starts at every label, so an edit
+    # only changes the hash of the region it falls in
+    regions = []
+    start = 0
+    for i, instruction in enumerate(instructions):
+        if instruction.type == "L" and i > start:
+            regions.append((start, i))
+            start = i
+    if start < len(instructions):
+        regions.append((start, len(instructions)))
+    return regions
+
+
+class AssemblyCache:
+    """Per-output cache for incremental reassembly.
+
+    Stored as two JSON lines next to the output: a small header (source
+    hash, options, output hash, symbol table, peephole savings) that is
+    enough for the unchanged-input check, then the encoded words of every
+    region keyed by the region's content hash, along with the symbols each
+    region refers to.
+    """
+
+    def __init__(self, output_name):
+        self.cache_name = output_name + ".cache"
+        self.header = None
+        self.regions = {}
+
+    def load_header(self):
+        try:
+            with open(self.cache_name, "r") as cache_file:
+                header = json.loads(cache_file.readline())
+        except (OSError, ValueError):
+            return None
+        if header.get("version") != CACHE_VERSION:
+            return None
+        self.header = header
+        return header
+
+    def load_regions(self):
+        if self.header is None:
+            return {}
+        try:
+            with open(self.cache_name, "r") as cache_file:
+                cache_file.readline()
+                self.regions = json.loads(cache_file.readline())
+        except (OSError, ValueError):
+            self.regions = {}
+        return self.regions
+
+    def is_fresh(self, source_hash, options, output_name):
+        # Unchanged input, same options and the output is still what we wrote
+        header = self.load_header()
+        return (header is not None
+                and header["source_hash"] == source_hash
+                and header["options"] == options
+                and header["output_hash"] == file_hash(output_name))
+
+    def lookup(self, region_hash, table):
+        # Cached words for a region, if every symbol it refers to still
+        # resolves to the address it had when the words were encoded
+        entry = self.regions.get(region_hash)
+        if entry is None:
+            return None
+        if any(table.get(symbol) != address for symbol, address in entry["symbols"].items()):
+            return None
+        return entry["words"]
+
+    def save(self, source_hash, options, output_name, symbols, regions, region_count,
+             peephole_saved=None):
+        header = {
+            "version": CACHE_VERSION,
+            "source_hash": source_hash,
+            "options": options,
+            "output_hash": file_hash(output_name),
+            "region_count": region_count,
+            "labels": {symbol: symbols.get_address(symbol) for symbol in symbols.labels},
+            "variables": {symbol: symbols.get_address(symbol) for symbol in symbols.variables},
+            # Words saved by each peephole rule, reported again on a fresh hit
+            "peephole_saved": peephole_saved or {},
+        }
+        with open(self.cache_name, "w") as cache_file:
+            cache_file.write(json.dumps(header) + "\n")
+            cache_file.write(json.dumps(regions) + "\n")
@@ -0,0 +1,194 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from Parser import Parser
+from Code import Code
+from SymbolTable import SymbolTable
+from Main import first_pass, second_pass, write_output
+from Emulator import Emulator, load_rom
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Test")
+CORPUS = {
+    "add": os.path.join(TEST_DIR, "add", "Add.asm"),
+    "max": os.path.join(TEST_DIR, "max", "Max.asm"),
+    "rect": os.path.join(TEST_DIR, "rect", "Rect.asm"),
+    "pong": os.path.join(TEST_DIR, "pong", "Pong.asm"),
+}
+LABEL_PATTERN = re.compile(r"^\s*\(([^)]+)\)", re.MULTILINE)
+SYMBOL_PATTERN = re.compile(r"([@(])([^\s)]+)")
+MIN_COMPARED_INSTRUCTIONS = 1000  # Smaller programs are timer noise
+
+
+def scale_program(file_name, copies, output_name):
+    # Repeat a program `copies` times, giving each copy its own labels so the
+    # result still assembles. Note the ROM stops fitting 32K quickly; that is
+    # fine for measuring the assembler itself.
+    with open(file_name, "r") as file:
+        source = file.read()
+    labels = set(LABEL_PATTERN.findall(source))
+
+    with open(output_name, "w") as output_file:
+        for copy in range(copies):
+            def rename(match):
+                symbol = match.group(2)
+                return match.group(1) + (f"{symbol}__{copy}" if symbol in labels else symbol)
+            output_file.write(SYMBOL_PATTERN.sub(rename, source))
+            output_file.write("\n")
+
+
+def run_phases(file_name, output_name):
+    timings = {}
+
+    start = time.perf_counter()
+    parser = Parser(file_name)
+    timings["cleaning"] = time.perf_counter() - start
+
+    code = Code()
+    symbols = SymbolTable()
+    start = time.perf_counter()
+    first_pass(parser, symbols)
+    timings["label_pass"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    binary_instructions = second_pass(parser, code, symbols)
+    timings["encoding"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_output(output_name, binary_instructions)
+    timings["write"] = time.perf_counter() - start
+
+    return timings, len(binary_instructions), code
+
+
+def benchmark(name, file_name, repeat, scratch_dir):
+    output_name = os.path.join(scratch_dir, name + ".hack")
+
+    # Timed runs: keep the fastest of each phase
+    best = None
+    for _ in range(repeat):
+        timings, instructions, code = run_phases(file_name, output_name)
+        best = timings if best is None else {phase: min(best[phase], timings[phase]) for phase in best}
+    total = sum(best.values())
+
+    # Untimed run under tracemalloc, which distorts timings
+    tracemalloc.start()
+    run_phases(file_name, output_name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "instructions": instructions,
+        "seconds": total,
+        "instructions_per_second": instructions / total if total else None,
+        "peak_memory_bytes": peak,
+        "phases": best,
+        "c_cache": {"hits": code.hits, "misses": code.misses},
+    }
+
+
+def benchmark_emulator(file_name, cycles, repeat):
+    # Runs the program for `cycles` instructions on the plain interpreter and
+    # on compiled basic blocks; block compilation is part of the timed run
+    rom = load_rom(file_name)
+    result = {"cycles": cycles}
+    final_ram = {}
+    for mode, blocks in (("interpreter", False), ("blocks", True)):
+        best = None
+        for _ in range(repeat):
+            emulator = Emulator(rom, blocks=blocks)
+            start = time.perf_counter()
+            emulator.run(cycles)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        final_ram[mode] = emulator.ram
+        result[mode] = {"seconds": best, "instructions_per_second": cycles / best if best else None}
+        if blocks:
+            result[mode]["blocks"] = len(emulator.block_cache)
+    if final_ram["interpreter"] != final_ram["blocks"]:
+        raise AssertionError("The block emulator and the interpreter disagree on the final RAM")
+    result["speedup"] = result["interpreter"]["seconds"] / result["blocks"]["seconds"]
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog="Benchmark")
+    arg_parser.add_argument("--scale", type=int, nargs="*", default=[4, 16],
+                            help="synthetic sizes, in copies of Pong.asm")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="timed runs per program")
+    arg_parser.add_argument("--output", help="write the JSON results to this file")
+    arg_parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    arg_parser.add_argument("--tolerance", type=float, default=0.10,
+                            help="allowed slowdown against the baseline (default: 10%%)")
+    arg_parser.add_argument("--emulate", type=int, default=0, metavar="CYCLES",
+                            help="also run Pong.hack this many instructions on the emulator, "
+                                 "interpreted and as compiled blocks")
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        programs = list(CORPUS.items())
+        for copies in args.scale:
+            scaled_name = os.path.join(scratch_dir, f"Pong_x{copies}.asm")
+            scale_program(CORPUS["pong"], copies, scaled_name)
+            programs.append((f"pong_x{copies}", scaled_name))
+
+        for name, file_name in programs:
+            result = benchmark(name, file_name, args.repeat, scratch_dir)
+            results.append(result)
+            print(f"{name:>12}: {result['instructions']:>8} instructions, "
+                  f"{result['instructions_per_second']:>12,.0f} instr/s, "
+                  f"peak {result['peak_memory_bytes'] / 1024:,.0f} KiB", file=sys.stderr)
+
+        emulator = None
+        if args.emulate:
+            emulator = benchmark_emulator(os.path.join(scratch_dir, "pong.hack"), args.emulate, args.repeat)
+            for mode in ("interpreter", "blocks"):
+                print(f"{mode:>12}: {args.emulate:>8} cycles, "
+                      f"{emulator[mode]['instructions_per_second']:>12,.0f} instr/s", file=sys.stderr)
+            print(f"{'speedup':>12}: {emulator['speedup']:.2f}x", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if emulator:
+        report["emulator"] = emulator
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline and compare(args.baseline, results, args.tolerance):
+        sys.exit(1)
+
+
+def compare(baseline_name, results, tolerance):
+    # Print throughput against an earlier run; returns True on a regression
+    with open(baseline_name, "r") as baseline_file:
+        baseline = {result["name"]: result for result in json.load(baseline_file)["results"]}
+
+    regressed = False
+    for result in results:
+        before = baseline.get(result["name"])
+        if not before or not before["instructions_per_second"] or not result["instructions_per_second"]:
+            continue
+        ratio = result["instructions_per_second"] / before["instructions_per_second"]
+        slower = ratio < 1 - tolerance and result["instructions"] >= MIN_COMPARED_INSTRUCTIONS
+        regressed = regressed or slower
+        print(f"{result['name']:>12}: {ratio:6.2f}x throughput{'  REGRESSION' if slower else ''}",
+              file=sys.stderr)
+    return regressed
+
+
+if __name__ == "__main__":
+    main()
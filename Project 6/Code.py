@@ -1,5 +1,8 @@
+from collections import OrderedDict
+
+
 class Code:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         self.comp_table = {
             "0": "0101010", "1": "0111111", "-1": "0111010", "D": "0001100", "A": "0110000",
             "M": "1110000", "!D": "0001101", "!A": "0110001", "!M": "1110001",
@@ -7,7 +10,11 @@ class Code:
             "A+1": "0110111", "M+1": "1110111", "D-1": "0001110", "A-1": "0110010",
             "M-1": "1110010", "D+A": "0000010", "D+M": "1000010", "D-A": "0010011",
             "D-M": "1010011", "A-D": "0000111", "M-D": "1000111", "D&A": "0000000",
-            "D&M": "1000000", "D|A": "0010101", "D|M": "1010101"
+            "D&M": "1000000", "D|A": "0010101", "D|M": "1010101",
+            # Operand-swapped spellings of the commutative operations, which
+            # the VM translators emit (e.g. "M=M+D")
+            "A+D": "0000010", "M+D": "1000010", "A&D": "0000000", "M&D": "1000000",
+            "A|D": "0010101", "M|D": "1010101"
         }
 
         self.dest_table = {
@@ -18,6 +25,12 @@ class Code:
             "": "000", "JGT": "001", "JEQ": "010", "JGE": "011", "JLT": "100", "JNE": "101", "JLE": "110", "JMP": "111"
         }
 
+        # Raw C-instruction text -> finished 16-bit word, least recently used first
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
     def comp(self, pattern):
         return self.comp_table[pattern]
 
@@ -26,3 +39,25 @@ class Code:
 
     def jump(self, pattern):
         return self.jump_table[pattern]
+
+    def c_instruction(self, command, fields=None):
+        # Encode a whole C-instruction ("dest=comp;jump") in one lookup;
+        # fields is its (dest, comp, jump) if the caller already split it
+        word = self.cache.get(command)
+        if word is not None:
+            self.hits += 1
+            self.cache.move_to_end(command)
+            return word
+
+        self.misses += 1
+        if fields is None:
+            dest, _, comp = command.rpartition("=")
+            comp, _, jump = comp.partition(";")
+        else:
+            dest, comp, jump = fields
+        word = f"111{self.comp(comp)}{self.dest(dest)}{self.jump(jump)}"
+
+        self.cache[command] = word
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return word
@@ -0,0 +1,266 @@
+import os
+import sys
+import time
+import argparse
+from array import array
+from PackedHack import PackedROM
+
+MEMORY_SIZE = 32768     # ROM and RAM words (the address bus is 15 bits)
+ADDRESS_MASK = 0x7FFF
+WORD_MASK = 0xFFFF
+SCREEN = 16384
+KBD = 24576
+
+
+def _alu_expression(c, x="x", y="y"):
+    # The Hack ALU (Project 5) for control bits zx nx zy ny f no, as a Python
+    # expression over x (D) and y (A or M); every combination of the six bits
+    # is covered, not only the 28 the assembler knows
+    zx, nx, zy, ny, f, no = ((c >> shift) & 1 for shift in range(5, -1, -1))
+    x = "0" if zx else x
+    x = f"~{x}" if nx else x
+    y = "0" if zy else y
+    y = f"~{y}" if ny else y
+    out = f"({x}) + ({y})" if f else f"({x}) & ({y})"
+    out = f"~({out})" if no else out
+    return f"({out}) & {WORD_MASK}"
+
+
+# Control bits -> the ALU as a function of (x, y)
+ALU = [eval(f"lambda x, y: {_alu_expression(c)}") for c in range(64)]
+# Jump bits (j1 j2 j3) -> whether each output sign (negative, zero,
+# positive) jumps
+JUMPS = [((j & 4) != 0, (j & 2) != 0, (j & 1) != 0) for j in range(8)]
+# The same, as Python conditions on the output o, for compiled blocks
+JUMP_CONDITIONS = ["False", "0 < o < 0x8000", "o == 0", "o < 0x8000",
+                   "o >= 0x8000", "o != 0", "o == 0 or o >= 0x8000", "True"]
+
+
+def decode(word):
+    # A-instructions stay plain ints; C-instructions become
+    # (alu, reads M, destination bits, jump bits)
+    if not word & 0x8000:
+        return word
+    return (ALU[(word >> 6) & 63], bool(word & 0x1000), (word >> 3) & 7, word & 7)
+
+
+def load_rom(file_name):
+    # Text .hack (one 16-digit binary word per line) or packed .hackb
+    if os.path.splitext(file_name)[1].lower() == ".hackb":
+        with PackedROM(file_name) as rom:
+            return array("H", rom.words)
+    with open(file_name, "r") as rom_file:
+        return array("H", (int(line, 2) for line in rom_file.read().split()))
+
+
+class Emulator:
+    """Headless Hack computer: the CPU of Project 5 with 32K words of ROM and
+    RAM. Every ROM word is decoded once, through precomputed tables, when
+    the program is loaded.
+
+    With blocks=True, run() works a basic block at a time instead: a
+    straight-line run of instructions up to and including a jump is compiled
+    once, on first entry, into a Python function, and cached by its entry
+    address. Blocks run whole, so when a cycle limit falls inside one the
+    rest is run an instruction at a time.
+
+    A program halts when it reaches the usual "(END) @END 0;JMP" loop, or
+    when it runs past the end of the ROM.
+    """
+
+    def __init__(self, rom, blocks=False):
+        self.blocks = blocks
+        self.ram = [0] * MEMORY_SIZE
+        self.load_program(rom)
+
+    def load_program(self, rom):
+        if len(rom) > MEMORY_SIZE:
+            raise ValueError(f"ROM has {len(rom)} words, more than {MEMORY_SIZE}")
+        self.rom = array("H", rom)
+        self.program = [decode(word) for word in self.rom]
+        # Addresses of unconditional jumps that land on the instruction
+        # loading their own target, i.e. the jump of a halt loop
+        self.halts = {pc for pc in range(1, len(self.rom))
+                      if self.rom[pc] & 0xE007 == 0xE007 and self.rom[pc - 1] == pc - 1}
+        self.reset()
+
+    def reset(self):
+        # The reset input clears the CPU only; memory keeps its contents.
+        # Compiled blocks are dropped too, since the ROM may have changed.
+        self.a = self.d = self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        self.block_cache = {}  # Entry address -> (function, instructions)
+
+    def load_ram(self, address, values):
+        for offset, value in enumerate(values):
+            self.ram[(address + offset) & ADDRESS_MASK] = value & WORD_MASK
+
+    def dump_ram(self, start, end, signed=False):
+        values = self.ram[start:end]
+        if signed:
+            values = [value - 0x10000 if value & 0x8000 else value for value in values]
+        return values
+
+    def run(self, max_cycles=None):
+        # Runs until the program halts or max_cycles instructions have run;
+        # returns the number of instructions run by this call
+        if self.blocks:
+            return self._run_blocks(max_cycles)
+        return self._run_instructions(max_cycles)
+
+    def _run_instructions(self, max_cycles):
+        program, ram, halts = self.program, self.ram, self.halts
+        size = len(program)
+        a, d, pc = self.a, self.d, self.pc
+        limit = max_cycles if max_cycles is not None else float("inf")
+        cycles = 0
+
+        while cycles < limit:
+            if pc >= size:
+                self.halted = True
+                break
+            instruction = program[pc]
+            cycles += 1
+            if instruction.__class__ is int:
+                a = instruction
+                pc += 1
+                continue
+
+            alu, reads_m, dest, jump = instruction
+            out = alu(d, ram[a & ADDRESS_MASK] if reads_m else a)
+            target = a  # Writes to M and jumps use A from before this instruction
+            if dest:
+                if dest & 1:
+                    ram[target & ADDRESS_MASK] = out
+                if dest & 2:
+                    d = out
+                if dest & 4:
+                    a = out
+            if jump:
+                negative, zero, positive = JUMPS[jump]
+                if (negative if out & 0x8000 else zero if out == 0 else positive):
+                    if pc in halts and target == pc - 1:
+                        self.halted = True
+                        break
+                    pc = target
+                    continue
+            pc += 1
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
+
+    def _run_blocks(self, max_cycles):
+        ram, block_cache = self.ram, self.block_cache
+        size = len(self.program)
+        a, d, pc = self.a, self.d, self.pc
+        limit = max_cycles if max_cycles is not None else float("inf")
+        cycles = 0
+
+        while True:
+            if pc >= size:
+                self.halted = True
+                break
+            block = block_cache.get(pc)
+            if block is None:
+                block = block_cache[pc] = self._compile_block(pc)
+            function, length = block
+            if cycles + length > limit:
+                # The limit falls inside this block
+                self.a, self.d, self.pc = a, d, pc
+                self.cycles += cycles
+                return cycles + self._run_instructions(limit - cycles)
+            a, d, pc, halted = function(ram, a, d)
+            cycles += length
+            if halted:
+                self.halted = True
+                break
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
+
+    def _compile_block(self, start):
+        # Python source for the block at start; the function takes and
+        # returns the registers, plus the next pc and whether it halted
+        lines = ["def block(ram, a, d):"]
+        pc = start
+        while pc < len(self.rom):
+            word = self.rom[pc]
+            if not word & 0x8000:
+                lines.append(f"    a = {word}")
+                pc += 1
+                continue
+
+            y = f"ram[a & {ADDRESS_MASK}]" if word & 0x1000 else "a"
+            dest, jump = (word >> 3) & 7, word & 7
+            lines.append(f"    o = {_alu_expression((word >> 6) & 63, 'd', y)}")
+            if jump:
+                lines.append("    t = a")  # Jumps use A from before the instruction
+            if dest & 1:
+                lines.append(f"    ram[a & {ADDRESS_MASK}] = o")
+            if dest & 2:
+                lines.append("    d = o")
+            if dest & 4:
+                lines.append("    a = o")
+            pc += 1
+            if jump:
+                halts = pc - 1 in self.halts
+                lines.append(f"    if {JUMP_CONDITIONS[jump]}:")
+                if halts:
+                    lines.append(f"        if t == {pc - 2}:")
+                    lines.append(f"            return a, d, {pc - 1}, True")
+                lines.append("        return a, d, t, False")
+                break
+        lines.append(f"    return a, d, {pc}, False")
+
+        namespace = {}
+        exec(compile("\n".join(lines), f"<block {start}>", "exec"), namespace)
+        return namespace["block"], pc - start
+
+
+def parse_load(text):
+    # "ADDRESS=V1,V2,..." -> (address, [values])
+    address, _, values = text.partition("=")
+    return int(address), [int(value) for value in values.split(",") if value]
+
+
+def parse_range(text):
+    # "START:END" (end exclusive) or a single address
+    start, _, end = text.partition(":")
+    return int(start), int(end) if end else int(start) + 1
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog="Emulator")
+    arg_parser.add_argument("rom", help="the .hack or .hackb program to run")
+    arg_parser.add_argument("--cycles", type=int, help="stop after this many instructions")
+    arg_parser.add_argument("--load", action="append", default=[], metavar="ADDRESS=V1,V2,...",
+                            help="set RAM words before running (repeatable)")
+    arg_parser.add_argument("--blocks", action="store_true",
+                            help="run compiled basic blocks instead of single instructions")
+    arg_parser.add_argument("--dump", action="append", default=[], metavar="START:END",
+                            help="print RAM words after running (repeatable)")
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    emulator = Emulator(load_rom(args.rom), blocks=args.blocks)
+    for text in args.load:
+        emulator.load_ram(*parse_load(text))
+
+    start = time.perf_counter()
+    cycles = emulator.run(args.cycles)
+    seconds = time.perf_counter() - start
+
+    for text in args.dump:
+        start_address, end_address = parse_range(text)
+        for address, value in enumerate(emulator.dump_ram(start_address, end_address, signed=True),
+                                        start_address):
+            print(f"RAM[{address}] = {value}")
+    print(f"{cycles} instructions in {seconds:.3f} s "
+          f"({cycles / seconds if seconds else 0:,.0f} instr/s), "
+          f"{'halted' if emulator.halted else 'stopped'} at pc {emulator.pc}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
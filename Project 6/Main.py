@@ -1,54 +1,360 @@
+import os
 import sys
-from Parser import Parser
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from Parser import Parser, Instruction
 from Code import Code
 from SymbolTable import SymbolTable
+from PackedHack import write_packed
+from Peephole import Peephole
+from AssemblyCache import AssemblyCache, content_hash, split_regions
+
+WORD_WIDTH = 17         # 16 binary digits plus the line separator
+NO_REFERENCE = 0xFFFF   # End of a backpatch chain (never a valid ROM address)
+ROM_SIZE = 32768        # Hack ROM words; backpatch chains only hold addresses below it
 
-def HackAssembler():
-    # Get file name from command line arguments
-    file_name = sys.argv[1]
-    output_name = file_name.replace(".asm", ".hack")
 
+def assemble(file_name, output_name, packed=False, peephole=None,
+             symbol_name=None, listing_name=None):
     parser = Parser(file_name)
+    symbols, binary_instructions = assemble_parser(parser, peephole)
+
+    # Write output to file
+    write_output(output_name, binary_instructions, packed)
+    if symbol_name:
+        write_symbols(symbol_name, symbols)
+    if listing_name:
+        write_listing(listing_name, parser.commands, binary_instructions)
+
+
+def assemble_parser(parser, peephole=None):
+    # Both passes over an already parsed program, e.g. Parser(lines=...) for
+    # in-memory source; returns the symbol table and the binary words
     code = Code()
     symbols = SymbolTable()
 
+    if peephole:
+        parser.set_commands(peephole.optimize(parser.commands))
+
+    first_pass(parser, symbols)
+    return symbols, second_pass(parser, code, symbols)
+
+
+def first_pass(parser, symbols):
     # First pass: Build the symbol table with labels
     rom_address = 0
-    while parser.has_more_commands():
-        parser.advance()
-        if parser.instruction_type() == "L":
-            symbols.add_entry(parser.symbol(), rom_address)
+    for instruction in parser.instructions:
+        if instruction.type == "L":
+            symbols.add_entry(instruction.symbol, rom_address, "label")
         else:
             rom_address += 1
 
+
+def second_pass(parser, code, symbols):
     # Second pass: Translate instructions to binary
-    parser.reset()  # Reset parser for second pass
-    next_ram_address = 16  # Start allocating RAM addresses at 16
-    binary_instructions = []
+    allocate_variables(parser, symbols)
+    return encode_instructions(parser.instructions, code, symbols.table)
+
+
+def write_output(output_name, binary_instructions, packed=False):
+    if packed:
+        write_packed(output_name, (int(word, 2) for word in binary_instructions))
+    else:
+        with open(output_name, "w") as output_file:
+            output_file.write("\n".join(binary_instructions))
 
-    while parser.has_more_commands():
-        parser.advance()
 
-        if parser.instruction_type() == "A":
-            symbol = parser.symbol()
-            if symbol.isdigit():
-                address = int(symbol)
+def write_symbols(symbol_name, symbols):
+    # One "<kind> <address> <symbol>" line per label (ROM) and variable (RAM)
+    with open(symbol_name, "w") as symbol_file:
+        for symbol in symbols.labels:
+            symbol_file.write(f"ROM {symbols.get_address(symbol)} {symbol}\n")
+        for symbol in symbols.variables:
+            symbol_file.write(f"RAM {symbols.get_address(symbol)} {symbol}\n")
+
+
+def write_listing(listing_name, commands, binary_instructions):
+    # ROM address, binary word and source instruction; labels get their own line
+    words = iter(binary_instructions)
+    rom_address = 0
+    with open(listing_name, "w") as listing_file:
+        for command in commands:
+            if command.startswith("("):
+                listing_file.write(f"{'':23}{command}\n")
             else:
-                if not symbols.contains(symbol):
-                    symbols.add_entry(symbol, next_ram_address)
-                    next_ram_address += 1
-                address = symbols.get_address(symbol)
+                listing_file.write(f"{rom_address:05d}  {next(words)}  {command}\n")
+                rom_address += 1
+
+
+def allocate_variables(parser, symbols):
+    # Give every unknown symbol a RAM address in order of first reference,
+    # the same order the second pass would allocate them in
+    next_ram_address = 16
+    for instruction in parser.instructions:
+        if instruction.type == "A" and instruction.address is None:
+            symbol = instruction.symbol
+            if not symbols.contains(symbol):
+                symbols.add_entry(symbol, next_ram_address, "variable")
+                next_ram_address += 1
+
+
+def encode_instructions(instructions, code, table):
+    # Encode instructions against a complete symbol table; the one encoder
+    # behind the two-pass, parallel and incremental assemblers
+    binary_instructions = []
+    for instruction in instructions:
+        if instruction.type == "A":
+            address = instruction.address
+            if address is None:
+                address = table[instruction.symbol]
             binary_instructions.append(f"{address:016b}")
+        elif instruction.type == "C":
+            binary_instructions.append(code.c_instruction(
+                instruction.text, (instruction.dest, instruction.comp, instruction.jump)))
+    return binary_instructions
 
-        elif parser.instruction_type() == "C":
-            comp = code.comp(parser.comp())
-            dest = code.dest(parser.dest())
-            jump = code.jump(parser.jump())
-            binary_instructions.append(f"111{comp}{dest}{jump}")
 
-    # Write output to file
-    with open(output_name, "w") as output_file:
-        output_file.write("\n".join(binary_instructions))
+# Per-worker state for the parallel assembler, set once by _init_worker
+_worker_table = None
+_worker_code = None
+
+
+def _init_worker(table):
+    global _worker_table, _worker_code
+    _worker_table = table
+    _worker_code = Code()
+
+
+def _encode_chunk(commands):
+    # Commands travel as text and are tokenized again here: pickling the
+    # parent's Instruction records costs the parent ~20x more than the text,
+    # serially, while re-tokenizing is spread across the workers
+    return encode_instructions([Instruction(command) for command in commands],
+                               _worker_code, _worker_table)
+
+
+def assemble_parallel(file_name, output_name, workers=None, packed=False, peephole=None,
+                      symbol_name=None, listing_name=None):
+    parser = Parser(file_name)
+    symbols = SymbolTable()
+
+    if peephole:
+        parser.set_commands(peephole.optimize(parser.commands))
+
+    first_pass(parser, symbols)
+
+    # Variable pre-scan: allocating RAM is the only order-dependent part of
+    # the second pass, so do it sequentially before fanning out
+    allocate_variables(parser, symbols)
+
+    # Second pass: every instruction is now independent, encode in chunks
+    workers = workers or os.cpu_count() or 1
+    commands = parser.commands
+    chunk_size = max(1, -(-len(commands) // (workers * 4)))
+    chunks = [commands[i:i + chunk_size] for i in range(0, len(commands), chunk_size)]
+
+    binary_instructions = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(symbols.table,)) as executor:
+        for chunk in executor.map(_encode_chunk, chunks):
+            binary_instructions.extend(chunk)
+
+    write_output(output_name, binary_instructions, packed)
+    if symbol_name:
+        write_symbols(symbol_name, symbols)
+    if listing_name:
+        write_listing(listing_name, parser.commands, binary_instructions)
+
+
+def assemble_incremental(file_name, output_name, packed=False, peephole=None,
+                         symbol_name=None, listing_name=None):
+    # Reuse the encoded words of every region whose text and referenced
+    # symbol addresses are unchanged since the last run. Returns the number
+    # of regions encoded and the total number of regions.
+    with open(file_name, "rb") as source_file:
+        source_hash = content_hash(source_file.read())
+    options = {"packed": packed, "optimize": peephole is not None}
+    cache = AssemblyCache(output_name)
+
+    if cache.is_fresh(source_hash, options, output_name) and not listing_name:
+        if symbol_name:
+            symbols = SymbolTable()
+            for symbol, address in cache.header["labels"].items():
+                symbols.add_entry(symbol, address, "label")
+            for symbol, address in cache.header["variables"].items():
+                symbols.add_entry(symbol, address, "variable")
+            write_symbols(symbol_name, symbols)
+        if peephole:
+            # The rewrites were not run again; report what they saved
+            for name, saved in cache.header["peephole_saved"].items():
+                peephole.saved[name] += saved
+        return 0, cache.header["region_count"]
+
+    parser = Parser(file_name)
+    code = Code()
+    symbols = SymbolTable()
+
+    if peephole:
+        parser.set_commands(peephole.optimize(parser.commands))
+
+    first_pass(parser, symbols)
+    allocate_variables(parser, symbols)
+
+    cache.load_regions()
+    regions = {}
+    binary_instructions = []
+    encoded = 0
+    spans = split_regions(parser.instructions)
+    for start, end in spans:
+        instructions = parser.instructions[start:end]
+        region_hash = content_hash("\n".join(instruction.text for instruction in instructions).encode())
+        words = cache.lookup(region_hash, symbols.table)
+        if words is None:
+            words = encode_instructions(instructions, code, symbols.table)
+            encoded += 1
+        referenced = {instruction.symbol: symbols.table[instruction.symbol] for instruction in instructions
+                      if instruction.type == "A" and instruction.address is None}
+        regions[region_hash] = {"symbols": referenced, "words": words}
+        binary_instructions.extend(words)
+
+    write_output(output_name, binary_instructions, packed)
+    if symbol_name:
+        write_symbols(symbol_name, symbols)
+    if listing_name:
+        write_listing(listing_name, parser.commands, binary_instructions)
+    cache.save(source_hash, options, output_name, symbols, regions, len(spans),
+               peephole.saved if peephole else None)
+    return encoded, len(spans)
+
+
+def _patch_chain(output_file, rom_address, address):
+    # Walk a backpatch chain: every unresolved slot holds the ROM address of
+    # the previous reference to the same symbol, the last one holds NO_REFERENCE
+    end = output_file.tell()
+    while rom_address != NO_REFERENCE:
+        output_file.seek(rom_address * WORD_WIDTH)
+        previous = int(output_file.read(16), 2)
+        output_file.seek(rom_address * WORD_WIDTH)
+        output_file.write(f"{address:016b}".encode())
+        rom_address = previous
+    output_file.seek(end)
+
+
+def assemble_streaming(file_name, output_name, symbol_name=None):
+    # Single pass: each instruction is encoded and written as soon as it is
+    # read. A reference to a symbol that is not known yet is written as a
+    # placeholder and threaded onto a per-symbol chain through the output
+    # file itself, so only the head of each chain is kept in memory.
+    parser = Parser(file_name, stream=True)
+    code = Code()
+    symbols = SymbolTable()
+    unresolved = {}  # symbol -> ROM address of its most recent reference
+    rom_address = 0
+
+    try:
+        with open(output_name, "w+b") as output_file:
+            while parser.has_more_commands():
+                parser.advance()
+                instruction_type = parser.instruction_type()
+
+                if instruction_type == "L":
+                    symbol = parser.symbol()
+                    symbols.add_entry(symbol, rom_address, "label")
+                    if symbol in unresolved:
+                        _patch_chain(output_file, unresolved.pop(symbol), rom_address)
+                    continue
+
+                if instruction_type == "A":
+                    symbol = parser.symbol()
+                    if symbol.isdigit():
+                        word = int(symbol)
+                    elif symbols.contains(symbol):
+                        word = symbols.get_address(symbol)
+                    else:
+                        word = unresolved.get(symbol, NO_REFERENCE)
+                        unresolved[symbol] = rom_address
+                    binary = f"{word:016b}"
+                else:
+                    binary = code.c_instruction(parser.current_command,
+                                                (parser.dest(), parser.comp(), parser.jump()))
+
+                # A placeholder past the ROM could collide with NO_REFERENCE and
+                # loop the chain forever; the two-pass modes have no such limit
+                if rom_address >= ROM_SIZE:
+                    raise ValueError(f"{file_name} has more than {ROM_SIZE} instructions, "
+                                     f"too many for --stream")
+                if rom_address:
+                    output_file.write(b"\n")
+                output_file.write(binary.encode())
+                rom_address += 1
+
+            # Whatever is still unresolved is a variable; allocate RAM in order of
+            # first reference, exactly as the two-pass assembler does
+            next_ram_address = 16
+            for symbol, last_reference in unresolved.items():
+                symbols.add_entry(symbol, next_ram_address, "variable")
+                _patch_chain(output_file, last_reference, next_ram_address)
+                next_ram_address += 1
+    finally:
+        parser.close()
+    if symbol_name:
+        write_symbols(symbol_name, symbols)
+
+
+def HackAssembler():
+    # Get file name from command line arguments
+    arg_parser = argparse.ArgumentParser(prog="Assembler")
+    arg_parser.add_argument("file_name", help="the .asm file to assemble")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="single-pass streaming assembly with backpatching")
+    arg_parser.add_argument("--packed", action="store_true",
+                            help="write a packed binary ROM (.hackb) instead of text")
+    arg_parser.add_argument("--parallel", type=int, nargs="?", const=0, metavar="WORKERS",
+                            help="encode across a process pool (default: one worker per CPU)")
+    arg_parser.add_argument("--optimize", action="store_true",
+                            help="apply peephole rewrites before encoding")
+    arg_parser.add_argument("--symbols", action="store_true",
+                            help="also write a .sym file of label and variable addresses")
+    arg_parser.add_argument("--listing", action="store_true",
+                            help="also write a .lst file of address, word and source")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="reuse unchanged regions from a cache next to the output")
+    args = arg_parser.parse_args(sys.argv[1:])
+    for option in ("packed", "parallel", "optimize", "listing", "incremental"):
+        if args.stream and getattr(args, option) not in (None, False):
+            arg_parser.error(f"--{option} cannot be combined with --stream")
+    if args.incremental and args.parallel is not None:
+        arg_parser.error("--parallel cannot be combined with --incremental")
+
+    file_name = args.file_name
+    output_name = file_name.replace(".asm", ".hackb" if args.packed else ".hack")
+    symbol_name = file_name.replace(".asm", ".sym") if args.symbols else None
+    listing_name = file_name.replace(".asm", ".lst") if args.listing else None
+
+    peephole = Peephole() if args.optimize else None
+
+    if args.stream:
+        try:
+            assemble_streaming(file_name, output_name, symbol_name=symbol_name)
+        except ValueError as error:
+            os.remove(output_name)
+            sys.exit(str(error))
+    elif args.incremental:
+        encoded, total = assemble_incremental(file_name, output_name, packed=args.packed,
+                                              peephole=peephole, symbol_name=symbol_name,
+                                              listing_name=listing_name)
+        print(f"Incremental: encoded {encoded} of {total} regions", file=sys.stderr)
+    elif args.parallel is not None:
+        assemble_parallel(file_name, output_name, workers=args.parallel, packed=args.packed,
+                          peephole=peephole, symbol_name=symbol_name, listing_name=listing_name)
+    else:
+        assemble(file_name, output_name, packed=args.packed, peephole=peephole,
+                 symbol_name=symbol_name, listing_name=listing_name)
+
+    if peephole:
+        print(f"Peephole: saved {peephole.words_saved()} words", file=sys.stderr)
+        for name, saved in peephole.saved.items():
+            print(f"  {name}: {saved}", file=sys.stderr)
 
 if __name__ == "__main__":
     HackAssembler()
@@ -0,0 +1,77 @@
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+# Packed .hack layout: a small header followed by the ROM as raw
+# little-endian uint16 words.
+#   magic   4 bytes  b"HACK"
+#   version uint16   PACKED_VERSION
+#   count   uint32   number of words that follow
+MAGIC = b"HACK"
+PACKED_VERSION = 1
+HEADER = struct.Struct("<4sHI")
+
+
+def write_packed(output_name, words):
+    # words: an iterable of ints in 0..65535
+    rom = array("H", words)
+    if sys.byteorder == "big":
+        rom.byteswap()
+    with open(output_name, "wb") as output_file:
+        output_file.write(HEADER.pack(MAGIC, PACKED_VERSION, len(rom)) + rom.tobytes())
+
+
+class PackedROM:
+    def __init__(self, file_name):
+        self.words = self.body = self.map = None
+        self.file = open(file_name, "rb")
+        try:
+            # Checked before mapping: an empty file cannot be mapped at all
+            size = os.fstat(self.file.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{file_name} is not a packed .hack file")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version, count = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or version != PACKED_VERSION:
+                raise ValueError(f"{file_name} is not a packed .hack file")
+            if size < HEADER.size + 2 * count:
+                raise ValueError(f"{file_name} is truncated: {count} words expected")
+
+            self.body = memoryview(self.map)[HEADER.size:HEADER.size + 2 * count]
+            if sys.byteorder == "little":
+                self.words = self.body.cast("H")  # zero-copy view over the mapping
+            else:
+                self.words = array("H", self.body)
+                self.words.byteswap()
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, address):
+        return self.words[address]
+
+    def to_text(self):
+        return "\n".join(f"{word:016b}" for word in self.words)
+
+    def close(self):
+        # Views must be released before the mapping can be closed
+        if isinstance(self.words, memoryview):
+            self.words.release()
+        if self.body is not None:
+            self.body.release()
+        if self.map is not None:
+            self.map.close()
+        self.words = self.body = self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
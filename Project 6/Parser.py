@@ -1,59 +1,125 @@
-class Parser:
-    def __init__(self, file_name):
-        with open(file_name, "r") as file:
-            self.lines = file.readlines()
+import re
+
+# One pattern tokenizes a cleaned line into its instruction fields
+INSTRUCTION_PATTERN = re.compile(
+    r"@(?P<symbol>.+)"
+    r"|\((?P<label>[^)]+)\)"
+    r"|(?:(?P<dest>[^=;]*)=)?(?P<comp>[^=;]+)(?:;(?P<jump>.*))?"
+)
+
+
+class Instruction:
+    # Compact record for one tokenized command
+    __slots__ = ("type", "text", "symbol", "address", "dest", "comp", "jump")
+
+    def __init__(self, text):
+        match = INSTRUCTION_PATTERN.fullmatch(text)
+        if match is None:
+            raise ValueError(f"Invalid instruction: {text}")
+        symbol, label, dest, comp, jump = match.group("symbol", "label", "dest", "comp", "jump")
 
-        self.commands = self._clean_lines()
+        self.text = text
+        self.address = None
+        self.dest = self.comp = self.jump = ""
+        if symbol is not None:
+            self.type = "A"
+            self.symbol = symbol
+            if symbol.isdigit():
+                self.address = int(symbol)
+        elif label is not None:
+            self.type = "L"
+            self.symbol = label
+        else:
+            self.type = "C"
+            self.symbol = None
+            self.dest = dest or ""
+            self.comp = comp
+            self.jump = jump or ""
+
+
+class Parser:
+    def __init__(self, file_name=None, stream=False, lines=None):
+        self.stream = stream
         self.current_command = ""
+        self.current_instruction = None
         self.current_index = -1
 
+        if stream:
+            # Streaming mode: read the source lazily, one cleaned command ahead
+            self.lines = None
+            self.commands = None
+            self.instructions = None
+            self.file = open(file_name, "r")
+            self.next_command = self._read_command()
+        else:
+            if lines is None:
+                with open(file_name, "r") as file:
+                    lines = file.readlines()
+            self.lines = lines  # Given directly for in-memory source
+
+            self.set_commands(self._clean_lines())
+
+    def set_commands(self, commands):
+        # Replace the cleaned commands (e.g. after rewriting) and tokenize them once
+        self.commands = commands
+        self.instructions = [Instruction(command) for command in commands]
+
+    def _clean_line(self, line):
+        return line.split("//")[0].strip()  # Remove comments and whitespace
+
     def _clean_lines(self):
         cleaned = []
         for line in self.lines:
-            line = line.split("//")[0].strip()  # Remove comments and whitespace
+            line = self._clean_line(line)
             if line:
                 cleaned.append(line)
         return cleaned
 
+    def _read_command(self):
+        for line in self.file:
+            line = self._clean_line(line)
+            if line:
+                return line
+        return None
+
     def has_more_commands(self):
+        if self.stream:
+            return self.next_command is not None
         return self.current_index + 1 < len(self.commands)
 
     def advance(self):
         self.current_index += 1
-        self.current_command = self.commands[self.current_index]
+        if self.stream:
+            self.current_command = self.next_command
+            self.current_instruction = Instruction(self.current_command)
+            self.next_command = self._read_command()
+        else:
+            self.current_command = self.commands[self.current_index]
+            self.current_instruction = self.instructions[self.current_index]
 
     def instruction_type(self):
-        if self.current_command.startswith("@"):
-            return "A"
-        elif self.current_command.startswith("("):
-            return "L"
-        else:
-            return "C"
+        return self.current_instruction.type
 
     def symbol(self):
-        if self.instruction_type() == "A":
-            return self.current_command[1:]
-        elif self.instruction_type() == "L":
-            return self.current_command[1:-1]
+        return self.current_instruction.symbol
 
     def dest(self):
-        if "=" in self.current_command:
-            return self.current_command.split("=")[0]
-        return ""
+        return self.current_instruction.dest
 
     def comp(self):
-        command = self.current_command
-        if "=" in command:
-            command = command.split("=")[1]
-        if ";" in command:
-            command = command.split(";")[0]
-        return command
+        return self.current_instruction.comp
 
     def jump(self):
-        if ";" in self.current_command:
-            return self.current_command.split(";")[1]
-        return ""
+        return self.current_instruction.jump
 
     def reset(self):
         self.current_command = ""
+        self.current_instruction = None
         self.current_index = -1
+        if self.stream:
+            self.file.seek(0)
+            self.next_command = self._read_command()
+
+    def close(self):
+        if self.stream:
+            self.file.close()
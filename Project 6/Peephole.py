@@ -0,0 +1,127 @@
+from SymbolTable import SymbolTable
+
+
+def _split(command):
+    # "dest=comp;jump" -> (dest, comp, jump), missing fields are ""
+    dest, _, comp = command.rpartition("=")
+    comp, _, jump = comp.partition(";")
+    return dest, comp, jump
+
+
+class Peephole:
+    """Sound peephole rewrites over cleaned assembly commands.
+
+    Every rule only looks at straight-line code: a label ends the window,
+    because control may arrive there from anywhere. Label addresses need no
+    bookkeeping since labels stay symbolic until the first pass; literal ROM
+    addresses cannot move, so code up to the highest literal jump target
+    (`@N` directly followed by a jump) is left untouched.
+    """
+
+    def __init__(self):
+        self.predefined = SymbolTable().table
+        self.rules = [
+            ("jump_to_next", self._jump_to_next),
+            ("redundant_a_load", self._redundant_a_load),
+            ("cancelling_increment", self._cancelling_increment),
+            ("no_op_move", self._no_op_move),
+        ]
+        self.saved = {name: 0 for name, _ in self.rules}
+
+    def words_saved(self):
+        return sum(self.saved.values())
+
+    def optimize(self, commands):
+        commands = list(commands)
+        changed = True
+        while changed:
+            changed = False
+            pinned = self._pinned_commands(commands)
+            for name, rule in self.rules:
+                optimized = rule(commands, pinned)
+                saved = len(commands) - len(optimized)
+                if saved:
+                    self.saved[name] += saved
+                    commands = optimized
+                    pinned = self._pinned_commands(commands)
+                    changed = True
+        return commands
+
+    def _pinned_commands(self, commands):
+        # Number of leading commands that must keep their ROM addresses
+        highest_target = -1
+        for i in range(len(commands) - 1):
+            symbol = commands[i][1:]
+            if commands[i].startswith("@") and symbol.isdigit() and _split(commands[i + 1])[2]:
+                highest_target = max(highest_target, int(symbol))
+
+        rom_address = 0
+        for i, command in enumerate(commands):
+            if rom_address > highest_target:
+                return i
+            if not command.startswith("("):
+                rom_address += 1
+        return len(commands)
+
+    def _a_value(self, command):
+        # Literal and predefined symbols compare by value, others by name
+        symbol = command[1:]
+        if symbol.isdigit():
+            return int(symbol)
+        return self.predefined.get(symbol, symbol)
+
+    def _jump_to_next(self, commands, pinned):
+        # "@L", "<comp>;J.." falling straight into "(L)": both paths lead to the
+        # next instruction. Only applied when that instruction reloads A, so
+        # nothing can observe the A value the jump left behind.
+        optimized = []
+        i = 0
+        while i < len(commands):
+            command = commands[i]
+            if i >= pinned and command.startswith("@") and i + 1 < len(commands):
+                dest, _, jump = _split(commands[i + 1])
+                j = i + 2
+                labels = set()
+                while j < len(commands) and commands[j].startswith("("):
+                    labels.add(commands[j][1:-1])
+                    j += 1
+                reloads_a = j == len(commands) or commands[j].startswith("@")
+                if jump and not dest and command[1:] in labels and reloads_a:
+                    i += 2
+                    continue
+            optimized.append(command)
+            i += 1
+        return optimized
+
+    def _redundant_a_load(self, commands, pinned):
+        # "@X" while A is already known to hold X, e.g. "@SP", "M=M+1", "@SP"
+        optimized = []
+        known = None
+        for i, command in enumerate(commands):
+            if command.startswith("("):
+                known = None
+            elif command.startswith("@"):
+                value = self._a_value(command)
+                if i >= pinned and value == known:
+                    continue
+                known = value
+            elif "A" in _split(command)[0]:
+                known = None
+            optimized.append(command)
+        return optimized
+
+    def _cancelling_increment(self, commands, pinned):
+        # "M=M+1" directly followed by "M=M-1" (or the reverse) on the same A
+        optimized = []
+        for i, command in enumerate(commands):
+            if (i > pinned and optimized and {optimized[-1], command} == {"M=M+1", "M=M-1"}
+                    and commands[i - 1] == optimized[-1]):
+                optimized.pop()
+                continue
+            optimized.append(command)
+        return optimized
+
+    def _no_op_move(self, commands, pinned):
+        # "D=D", "M=M", "A=A": assigns a register to itself with no jump
+        return [command for i, command in enumerate(commands)
+                if i < pinned or command not in ("D=D", "M=M", "A=A")]
@@ -25,9 +25,15 @@ class SymbolTable:
             "SCREEN": 16384,
             "KBD": 24576
         }
+        self.labels = []     # Symbols added as ROM labels, in definition order
+        self.variables = []  # Symbols allocated in RAM, in allocation order
 
-    def add_entry(self, symbol, address):
+    def add_entry(self, symbol, address, kind=None):
         self.table[symbol] = address
+        if kind == "label":
+            self.labels.append(symbol)
+        elif kind == "variable":
+            self.variables.append(symbol)
 
     def contains(self, symbol):
         return symbol in self.table
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+from Main import ROM_SIZE, assemble, assemble_streaming
+
+
+def write_program(directory, instructions):
+    # `instructions` words: a forward reference to END first, so a backpatch
+    # chain is open for the whole program, then padding up to the halt loop
+    asm_name = os.path.join(directory, "Big.asm")
+    with open(asm_name, "w") as asm_file:
+        asm_file.write("@END\n")
+        asm_file.write("D=0\n" * (instructions - 3))
+        asm_file.write("(END)\n@END\n0;JMP\n")
+    return asm_name
+
+
+class StreamingOverflowTest(unittest.TestCase):
+    def test_largest_program_matches_two_pass(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asm_name = write_program(directory, ROM_SIZE)
+            streamed_name = os.path.join(directory, "Streamed.hack")
+            two_pass_name = os.path.join(directory, "TwoPass.hack")
+            assemble_streaming(asm_name, streamed_name)
+            assemble(asm_name, two_pass_name)
+            with open(streamed_name) as streamed, open(two_pass_name) as two_pass:
+                self.assertEqual(streamed.read(), two_pass.read())
+
+    def test_program_past_the_rom_is_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asm_name = write_program(directory, ROM_SIZE + 1)
+            with self.assertRaises(ValueError):
+                assemble_streaming(asm_name, os.path.join(directory, "Big.hack"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,25 +1,62 @@
+from collections import namedtuple
+
+# One line of emitted assembly: kind is "A", "C", "L" (a label) or "comment"
+AsmInstruction = namedtuple("AsmInstruction", ["kind", "text"])
+
+COMPARISONS = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}
+
+
+def to_instructions(asm):
+    # Splits a piece of assembly into AsmInstruction records
+    instructions = []
+    for line in asm.splitlines():
+        if not line:
+            continue
+        if line.startswith("//"):
+            kind = "comment"
+        elif line.startswith("@"):
+            kind = "A"
+        elif line.startswith("("):
+            kind = "L"
+        else:
+            kind = "C"
+        instructions.append(AsmInstruction(kind, line))
+    return instructions
+
+
 class CodeWriter:
-    def __init__(self, output_file):
-        self.file = open(output_file, "w")
+    def __init__(self, output_file, verbose=False):
+        self.output_file = output_file
+        self.verbose = verbose
+        self.instructions = []             # Everything emitted, written out once by close()
         self.label_counter = 0             # Counter for generating unique labels
 
+    def emit(self, asm):
+        # Adds a piece of assembly to the instruction buffer
+        self.instructions.extend(to_instructions(asm))
+
+    def write_comment(self, text):
+        # Annotates the output with the VM command being translated, in verbose mode only
+        if self.verbose:
+            self.instructions.append(AsmInstruction("comment", f"// {text}"))
+
     def writeInit(self):
         # Writes the Hack assembly code that initializes the VM
-        self.file.write("@256\nD=A\n@SP\nM=D\n")
+        self.emit("@256\nD=A\n@SP\nM=D\n")
         self.write_call("Sys.init", 0)
 
     def writeLabel(self, label: str):
         # Writes the Hack assembly code that sets a label
-        self.file.write(f"({label})\n")
+        self.emit(f"({label})\n")
 
     def writeGoto(self, label: str):
         # Writes the Hack assembly code that jumps to the specified label
-        self.file.write(f"@{label}\n0;JMP\n")
+        self.emit(f"@{label}\n0;JMP\n")
 
     def writeIf(self, label: str):
         # Writes the Hack assembly code that jumps to the specified label if the top of the stack is not zero
-        self.file.write("@SP\nAM=M-1\nD=M\n")
-        self.file.write(f"@{label}\nD;JNE\n")
+        self.emit("@SP\nAM=M-1\nD=M\n")
+        self.emit(f"@{label}\nD;JNE\n")
 
     def setFileName(self, file_name: str):
         self.fileName = file_name
@@ -33,11 +70,12 @@ class CodeWriter:
             "not": "@SP\nA=M-1\nM=!M\n",
             "and": "@SP\nAM=M-1\nD=M\n@SP\nA=M-1\nM=M&D\n",
             "or": "@SP\nAM=M-1\nD=M\n@SP\nA=M-1\nM=M|D\n",
-            "eq": self._write_comparison("JEQ"),
-            "gt": self._write_comparison("JGT"),
-            "lt": self._write_comparison("JLT"),
         }
-        self.file.write(operations[command])
+        if command in COMPARISONS:
+            # Built on demand, so only comparisons use up labels
+            self.emit(self._write_comparison(COMPARISONS[command]))
+        else:
+            self.emit(operations[command])
 
     def _write_comparison(self, jump_type):
         # Generates unique labels for comparison commands
@@ -57,14 +95,16 @@ class CodeWriter:
         # Generates Hack code for push and pop commands
         if command_type == "C_PUSH":
             if segment == "constant":
-                self.file.write(f"@{index}\nD=A\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
+                self.emit(f"@{index}\nD=A\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
         elif command_type == "C_POP":
             if segment == "local":
-                self.file.write(
+                self.emit(
                     f"@{index}\nD=A\n@LCL\nD=M+D\n@R13\nM=D\n"
                     "@SP\nAM=M-1\nD=M\n@R13\nA=M\nM=D\n"
                 )
 
     def close(self):
-        # Closes the output file
-        self.file.close()
+        # Writes the instruction buffer to the output file in one go
+        with open(self.output_file, "w") as file:
+            file.write("".join(instruction.text + "\n" for instruction in self.instructions))
+        self.instructions = []
@@ -6,13 +6,17 @@ def main():
 
     input_file = sys.argv[1]
     output_file = input_file.replace(".vm", ".asm")
+    verbose = "--verbose" in sys.argv[2:]  # Echo every command and comment the output
 
     parser = Parser(input_file)
-    code_writer = CodeWriter(output_file)
+    code_writer = CodeWriter(output_file, verbose)
 
     while parser.has_more_commands():
         parser.advance()
         command_type = parser.command_type()
+        if verbose:
+            print(parser.current_command, file=sys.stderr)
+        code_writer.write_comment(parser.current_command)
 
         if command_type == "C_ARITHMETIC":
             code_writer.write_arithmetic(parser.arg1())
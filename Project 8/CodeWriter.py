@@ -5,18 +5,93 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import io
 import typing
+import collections
+
+# Entry points of the shared call/return routines (see write_shared_routines)
+SHARED_CALL = "__VM_CALL"
+SHARED_RETURN = "__VM_RETURN"
+# Entry points of the shared comparison routine (see write_shared_compare)
+SHARED_COMPARE = {"gt": "__VM_GT", "lt": "__VM_LT"}
+
+
+class AsmInstruction(typing.NamedTuple):
+    """One line of emitted assembly: kind is "A", "C", "L" (a label) or
+    "comment"."""
+    kind: str
+    text: str
+
+
+def to_instructions(asm: str) -> typing.List[AsmInstruction]:
+    """Splits a piece of assembly into AsmInstruction records."""
+    instructions = []
+    for line in asm.splitlines():
+        if not line:
+            continue
+        if line.startswith("//"):
+            kind = "comment"
+        elif line.startswith("@"):
+            kind = "A"
+        elif line.startswith("("):
+            kind = "L"
+        else:
+            kind = "C"
+        instructions.append(AsmInstruction(kind, line))
+    return instructions
+
+
+def count_instructions(asm: str) -> int:
+    """Counts the ROM words in a piece of assembly (labels and comments
+    take none)."""
+    return sum(1 for line in asm.splitlines()
+               if line and not line.startswith(("(", "//")))
+
 
 class CodeWriter:
     remember = [0]
     index_2 = 0
 
-    def __init__(self, output_stream: typing.TextIO) -> None:
+    # Cycles spent by one gt/lt on same-sign operands (true, false result),
+    # counted along the executed paths of write_gt_lt_eq and of a shared
+    # call site plus write_shared_compare
+    INLINE_COMPARE_CYCLES = (41, 43)
+    SHARED_COMPARE_CYCLES = (36, 38)
+
+    # Binary arithmetic on y in D and x in M, leaving the result in D
+    CACHED_ARITHMETIC = {
+        "add": "D=D+M\n",
+        "sub": "D=M-D\n",
+        "and": "D=D&M\n",
+        "or": "D=D|M\n",
+    }
+    CACHED_UNARY = {"neg": "D=-D\n", "not": "D=!D\n"}
+
+    def __init__(self, output_stream: typing.TextIO,
+                 shared_calls: bool = False,
+                 shared_compare: bool = False,
+                 cache_top: bool = False,
+                 verbose: bool = False,
+                 source_map: bool = False) -> None:
 
         # Your code goes here!
-        # Note that you can write to output_stream like so:
-        # output_stream.write("Hello world! \n")
         self.output_stream = output_stream
+        # Everything is emitted into this list and written out once by
+        # flush(); comments are only kept in verbose mode
+        self.instructions = []
+        self.verbose = verbose
+        # With source_map, the VM line and function behind every ROM word;
+        # source_line is set by the caller before each command
+        self.source_map = source_map
+        self.source_line = None
+        self.sources = []
+        self.shared_calls = shared_calls
+        self.shared_compare = shared_compare
+        # With cache_top, the logical stack top may live in D instead of
+        # RAM[SP - 1]; top_in_d says whether it does right now
+        self.cache_top = cache_top
+        self.top_in_d = False
+        self.stats = collections.Counter()
         self.file_name = None
         self.cur_func = "OS"
         self.lab = 0
@@ -31,6 +106,8 @@ class CodeWriter:
             'not': "@SP\nA=M-1\nM=!M\n",
             'neg': "@SP\nA=M-1\nM=-M\n"}
 
+        # Counts comparison labels; they are prefixed with the file name,
+        # so every file (and every parallel worker) can count from 0
         self.index_gt_lq = 0
 
         self.segment_map = {
@@ -43,67 +120,125 @@ class CodeWriter:
     def set_file_name(self, filename: str) -> None:
         self.file_name = filename
 
+    def emit(self, asm: str) -> None:
+        """Adds a piece of assembly to the instruction buffer."""
+        instructions = to_instructions(asm)
+        self.instructions.extend(instructions)
+        if self.source_map:
+            source = (self.source_line, self.cur_func)
+            self.sources.extend(source for instruction in instructions
+                                if instruction.kind in ("A", "C"))
+
+    def source_ranges(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Returns the source map of everything emitted so far, as runs of
+        consecutive words that come from the same VM line and function.
+
+        Returns:
+            typing.List[typing.Dict[str, typing.Any]]: one dict per run, with
+                the keys words, file, line and function. line is None for
+                code that no VM command produced (bootstrap, shared routines).
+        """
+        ranges = []
+        for line, function in self.sources:
+            if ranges and (ranges[-1]["line"], ranges[-1]["function"]) == (line, function):
+                ranges[-1]["words"] += 1
+            else:
+                ranges.append({"words": 1,
+                               "file": f"{self.file_name}.vm" if line else None,
+                               "line": line, "function": function})
+        return ranges
+
+    def word_count(self) -> int:
+        """Returns the ROM words in the instruction buffer."""
+        return sum(1 for instruction in self.instructions
+                   if instruction.kind in ("A", "C"))
+
+    def flush(self) -> None:
+        """Writes the instruction buffer to the output stream in one go."""
+        lines = [instruction.text for instruction in self.instructions
+                 if self.verbose or instruction.kind != "comment"]
+        if lines:
+            self.output_stream.write("\n".join(lines) + "\n")
+        self.instructions = []
+
+    def spill_top(self) -> None:
+        """Writes the stack top back from D to RAM if it is cached there.
+        Called before anything that reads the stack from RAM, jumps, or
+        clobbers D."""
+        if self.top_in_d:
+            self.emit("@SP\nAM=M+1\nA=A-1\nM=D\n")
+            self.top_in_d = False
+            self.stats["top_spills"] += 1
+
+    def fill_top(self) -> None:
+        """Pops the stack top from RAM into D, unless it is there already."""
+        if self.top_in_d:
+            self.stats["top_reuses"] += 1
+        else:
+            self.emit("@SP\nAM=M-1\nD=M\n")
+            self.top_in_d = True
+
 
 
     def write_gt_lt_eq(self, command: str) -> None:
-        self.output_stream.write(f'@SP\nAM=M-1\nD=M\n')
-        self.output_stream.write(f'@R14\nM=D\n')
-        self.output_stream.write(f'@R13\nM=D\n')
-        self.output_stream.write(f'@R13\nD=M\n')
-        self.output_stream.write(f'@CASE1_{self.index_gt_lq}\nD;JLT\n')
-        self.output_stream.write(f'@SP\nD=M\n')
-
-        self.output_stream.write(f'@SP\nAM=M-1\nD=M\n')
-        self.output_stream.write(f'@R13\nM=D\n')
-
-        self.output_stream.write(f'@CASE2_{self.index_gt_lq}\nD;JLT\n')
-
-        self.output_stream.write(f'@R14\nD=D-M\n')
-        self.output_stream.write(f'@R13\nM=D\n')
-        self.output_stream.write(f'@SP\nD=M\n')
-        self.output_stream.write(f'@FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
-
-        self.output_stream.write(f'(CASE1_{self.index_gt_lq})\n')
-        self.output_stream.write(f'@SP\nD=M\n')
-        self.output_stream.write(f'@SP\nAM=M-1\nD=M\n')
-        self.output_stream.write(f'@CASE3_{self.index_gt_lq}\nD;JGT\n')
-        self.output_stream.write(f'@R14\nD=D-M\n')
-        self.output_stream.write(f'@R13\nM=D\n')
-        self.output_stream.write(f'@SP\nD=M\n')
-        self.output_stream.write(f'@FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
-
-        self.output_stream.write(f'(CASE2_{self.index_gt_lq})\n')
-        self.output_stream.write(f'@SP\nD=M\n')
-        self.output_stream.write(f'@R13\nM=-1\n')
-        self.output_stream.write(f'@FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
-
-        self.output_stream.write(f'(CASE3_{self.index_gt_lq})\n')
-        self.output_stream.write(f'@SP\nD=M\n')
-        self.output_stream.write(f'@R13\nM=1\n')
-        self.output_stream.write(f'@FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
+        self.emit(f'@SP\nAM=M-1\nD=M\n')
+        self.emit(f'@R14\nM=D\n')
+        self.emit(f'@R13\nM=D\n')
+        self.emit(f'@R13\nD=M\n')
+        self.emit(f'@{self.file_name}$CASE1_{self.index_gt_lq}\nD;JLT\n')
+        self.emit(f'@SP\nD=M\n')
+
+        self.emit(f'@SP\nAM=M-1\nD=M\n')
+        self.emit(f'@R13\nM=D\n')
+
+        self.emit(f'@{self.file_name}$CASE2_{self.index_gt_lq}\nD;JLT\n')
+
+        self.emit(f'@R14\nD=D-M\n')
+        self.emit(f'@R13\nM=D\n')
+        self.emit(f'@SP\nD=M\n')
+        self.emit(f'@{self.file_name}$FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
+
+        self.emit(f'({self.file_name}$CASE1_{self.index_gt_lq})\n')
+        self.emit(f'@SP\nD=M\n')
+        self.emit(f'@SP\nAM=M-1\nD=M\n')
+        self.emit(f'@{self.file_name}$CASE3_{self.index_gt_lq}\nD;JGE\n')
+        self.emit(f'@R14\nD=D-M\n')
+        self.emit(f'@R13\nM=D\n')
+        self.emit(f'@SP\nD=M\n')
+        self.emit(f'@{self.file_name}$FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
+
+        self.emit(f'({self.file_name}$CASE2_{self.index_gt_lq})\n')
+        self.emit(f'@SP\nD=M\n')
+        self.emit(f'@R13\nM=-1\n')
+        self.emit(f'@{self.file_name}$FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
+
+        self.emit(f'({self.file_name}$CASE3_{self.index_gt_lq})\n')
+        self.emit(f'@SP\nD=M\n')
+        self.emit(f'@R13\nM=1\n')
+        self.emit(f'@{self.file_name}$FINISH_LEVEL1_{self.index_gt_lq}\n0;JMP\n')
 
         cur = ''
         cur_at = ''
         if command == "eq":
             cur = 'EQ'
-            cur_at = f'EQUAL{self.index_gt_lq}'
+            cur_at = f'{self.file_name}$EQUAL{self.index_gt_lq}'
         elif command == "gt":
             cur = 'GT'
-            cur_at = f'X_BIGGER_Y{self.index_gt_lq}'
+            cur_at = f'{self.file_name}$X_BIGGER_Y{self.index_gt_lq}'
         elif command == "lt":
             cur = 'LT'
-            cur_at = f'Y_BIGGER_X{self.index_gt_lq}'
-
-        self.output_stream.write(f'(FINISH_LEVEL1_{self.index_gt_lq})\n')
-        self.output_stream.write(f'@R13\nD=M\n')
-        self.output_stream.write(f'@{cur_at}\nD;J{cur}\n')
-        self.output_stream.write(f'@SP\nA=M\nM=0\n')
-        self.output_stream.write(f'@END{self.index_gt_lq}\n0;JMP\n')
-        self.output_stream.write(f'({cur_at})\n')
-        self.output_stream.write(f'@SP\nA=M\nM=-1\n')
-        self.output_stream.write(f'(END{self.index_gt_lq})\n@SP\nM=M+1\n')
-        self.output_stream.write(f'@R14\nM=0\n')
-        self.output_stream.write(f'@R13\nM=0\n')
+            cur_at = f'{self.file_name}$Y_BIGGER_X{self.index_gt_lq}'
+
+        self.emit(f'({self.file_name}$FINISH_LEVEL1_{self.index_gt_lq})\n')
+        self.emit(f'@R13\nD=M\n')
+        self.emit(f'@{cur_at}\nD;J{cur}\n')
+        self.emit(f'@SP\nA=M\nM=0\n')
+        self.emit(f'@{self.file_name}$END{self.index_gt_lq}\n0;JMP\n')
+        self.emit(f'({cur_at})\n')
+        self.emit(f'@SP\nA=M\nM=-1\n')
+        self.emit(f'({self.file_name}$END{self.index_gt_lq})\n@SP\nM=M+1\n')
+        self.emit(f'@R14\nM=0\n')
+        self.emit(f'@R13\nM=0\n')
         self.index_gt_lq += 1
         self.remember[0] += 1
 
@@ -117,21 +252,30 @@ class CodeWriter:
             command (str): an arithmetic command.
         """
         # Your code goes here!
-        if command in self.arithmetic_commands:
-            self.output_stream.write("@SP\n")
-            self.output_stream.write("AM=M-1\n")
-            self.output_stream.write("D=M\n")
-            self.output_stream.write("A=A-1\n")
-            self.output_stream.write(self.arithmetic_commands[command])
+        if self.cache_top and (command in self.CACHED_ARITHMETIC
+                               or command in self.CACHED_UNARY and self.top_in_d):
+            self.write_cached_arithmetic(command)
+            return
+        self.spill_top()
+
+        if self.shared_compare and command in SHARED_COMPARE:
+            self.write_shared_comparison(command)
+
+        elif command in self.arithmetic_commands:
+            self.emit("@SP\n")
+            self.emit("AM=M-1\n")
+            self.emit("D=M\n")
+            self.emit("A=A-1\n")
+            self.emit(self.arithmetic_commands[command])
 
         elif command == "eq":
-            self.output_stream.write("@SP\n")
-            self.output_stream.write("AM=M-1\n")
-            self.output_stream.write("D=M\n")
-            self.output_stream.write("A=A-1\n")
-            self.output_stream.write(f"D=M-D\nM=-1\n@END{self.index_gt_lq}\n")
-            self.output_stream.write("D;JEQ\n")
-            self.output_stream.write(f"@SP\nA=M-1\nM=0\n(END{self.index_gt_lq})\n")
+            self.emit("@SP\n")
+            self.emit("AM=M-1\n")
+            self.emit("D=M\n")
+            self.emit("A=A-1\n")
+            self.emit(f"D=M-D\nM=-1\n@{self.file_name}$END{self.index_gt_lq}\n")
+            self.emit("D;JEQ\n")
+            self.emit(f"@SP\nA=M-1\nM=0\n({self.file_name}$END{self.index_gt_lq})\n")
             self.index_gt_lq += 1
 
         elif command == "lt" or command == "gt":
@@ -139,9 +283,24 @@ class CodeWriter:
 
 
         elif command in self.not_commands:
-            self.output_stream.write(self.not_commands[command])
+            self.emit(self.not_commands[command])
 
 
+    def write_cached_arithmetic(self, command: str) -> None:
+        """Writes arithmetic that takes its last operand from D and leaves
+        the result there (cache_top mode).
+
+        Args:
+            command (str): add, sub, and, or, or neg/not with the top in D.
+        """
+        if command in self.CACHED_UNARY:
+            self.stats["top_reuses"] += 1
+            self.emit(self.CACHED_UNARY[command])
+            return
+        self.fill_top()
+        self.emit("@SP\nAM=M-1\n")
+        self.emit(self.CACHED_ARITHMETIC[command])
+
     def write_push_pop(self, command: str, segment: str, index: int) -> None:
         """Writes assembly code that is the translation of the given
         command, where command is either C_PUSH or C_POP.
@@ -156,114 +315,339 @@ class CodeWriter:
         # be translated to the assembly symbol "Xxx.i". In the subsequent
         # assembly process, the Hack assembler will allocate these symbolic
         # variables to the RAM, starting at address 16.
-        if command == "C_PUSH":
-            if segment in self.segment_map:
-                self.output_stream.write(f"@{self.segment_map[segment]}\n")
-                self.output_stream.write("D=M\n")
-                self.output_stream.write(f"@{index}\nA=D+A\nD=M\n")
-            elif segment == "constant":
-                self.output_stream.write(f"@{index}\nD=A\n")
-
-            elif segment == "temp":
-                self.output_stream.write(f"@{index}\nD=A\n")
-                self.output_stream.write("@R5\nA=D+A\nD=M\n")
-
-            elif segment == "static":
-                self.output_stream.write(f"@{self.file_name}.{index}\nD=M\n")
+        if command == "C_PUSH" and self.cache_top:
+            # Leave the value in D; the previous top goes back to RAM
+            self.spill_top()
+            self.write_load_d(segment, index)
+            self.top_in_d = True
+            return
+        if command == "C_POP" and self.top_in_d and self.can_store_d(segment, index):
+            self.stats["top_reuses"] += 1
+            self.write_store_d(segment, index)
+            self.top_in_d = False
+            return
+        self.spill_top()
 
+        if command == "C_PUSH":
+            self.write_load_d(segment, index)
 
-            elif segment == "pointer":
-                if index == 0:
-                    self.output_stream.write("@THIS\n")  # verifier si c est this
-                elif index == 1:
-                    self.output_stream.write("@THAT\n")  # verifier si c est that
-                self.output_stream.write("D=M\n")
-
-            self.output_stream.write("@SP\n")
-            self.output_stream.write("A=M\n")
-            self.output_stream.write("M=D\n")
-            self.output_stream.write("@SP\n")
-            self.output_stream.write("M=M+1\n")
+            self.emit("@SP\n")
+            self.emit("A=M\n")
+            self.emit("M=D\n")
+            self.emit("@SP\n")
+            self.emit("M=M+1\n")
 
         elif command == "C_POP":
             if segment in self.segment_map:
-                self.output_stream.write(f"@{self.segment_map[segment]}\n")
-                self.output_stream.write("D=M\n")
-                self.output_stream.write(f"@{index}\nD=D+A\n")
-                self.output_stream.write("@SP\nAM=M-1\nD=D+M\nA=D-M\nM=D-A\n")
+                self.emit(f"@{self.segment_map[segment]}\n")
+                self.emit("D=M\n")
+                self.emit(f"@{index}\nD=D+A\n")
+                self.emit("@SP\nAM=M-1\nD=D+M\nA=D-M\nM=D-A\n")
             if segment == "temp":
-                self.output_stream.write("@5\n")
-                self.output_stream.write("D=A\n")
-                self.output_stream.write(f"@{index}\nD=D+A\n")
-                self.output_stream.write("@SP\nAM=M-1\nD=D+M\nA=D-M\nM=D-A\n")
+                self.emit("@5\n")
+                self.emit("D=A\n")
+                self.emit(f"@{index}\nD=D+A\n")
+                self.emit("@SP\nAM=M-1\nD=D+M\nA=D-M\nM=D-A\n")
             elif segment == "static":
-                self.output_stream.write("@SP\nAM=M-1\nD=M\n")
-                self.output_stream.write(f"@{self.file_name}.{index}\nM=D\n")
+                self.emit("@SP\nAM=M-1\nD=M\n")
+                self.emit(f"@{self.file_name}.{index}\nM=D\n")
             elif segment == "pointer":
-                self.output_stream.write("@SP\nAM=M-1\nD=M\n")
+                self.emit("@SP\nAM=M-1\nD=M\n")
                 if index == 0:
-                    self.output_stream.write("@THIS\n")
+                    self.emit("@THIS\n")
                 elif index == 1:
-                    self.output_stream.write("@THAT\n")
-                self.output_stream.write("M=D\n")
+                    self.emit("@THAT\n")
+                self.emit("M=D\n")
+
+    def write_load_d(self, segment: str, index: int) -> None:
+        """Writes assembly code that loads the value of segment[index] into
+        the D register.
+
+        Args:
+            segment (str): the memory segment to read from.
+            index (int): the index in the memory segment.
+        """
+        if segment in self.segment_map:
+            self.emit(f"@{self.segment_map[segment]}\n")
+            self.emit("D=M\n")
+            self.emit(f"@{index}\nA=D+A\nD=M\n")
+        elif segment == "constant" and not 0 <= int(index) <= 32767:
+            # Only the optimizer produces these: an A-instruction holds 15
+            # bits, so load the complement and flip it
+            self.emit(f"@{~int(index) & 0x7FFF}\nD=!A\n")
+        elif segment == "constant":
+            self.emit(f"@{index}\nD=A\n")
+
+        elif segment == "temp":
+            self.emit(f"@{index}\nD=A\n")
+            self.emit("@R5\nA=D+A\nD=M\n")
+
+        elif segment == "static":
+            self.emit(f"@{self.file_name}.{index}\nD=M\n")
+
+
+        elif segment == "pointer":
+            if index == 0:
+                self.emit("@THIS\n")  # verifier si c est this
+            elif index == 1:
+                self.emit("@THAT\n")  # verifier si c est that
+            self.emit("D=M\n")
+
+    def write_move(self, src_segment: str, src_index: int,
+                   dst_segment: str, dst_index: int) -> None:
+        """Writes assembly code for "push src_segment src_index" followed by
+        "pop dst_segment dst_index" as a direct memory-to-memory move that
+        never touches the stack.
+
+        Args:
+            src_segment (str): the memory segment to read from.
+            src_index (int): the index in the source segment.
+            dst_segment (str): the memory segment to write to.
+            dst_index (int): the index in the destination segment.
+        """
+        self.spill_top()
+        self.emit(f"//move {src_segment} {src_index} "
+                  f"-> {dst_segment} {dst_index}\n")
+        if dst_segment in self.segment_map and dst_index > 1:
+            # The target address needs D, so park it in R13 first
+            self.emit(f"@{self.segment_map[dst_segment]}\n"
+                      f"D=M\n@{dst_index}\nD=D+A\n"
+                      "@R13\nM=D\n")
+            self.write_load_d(src_segment, src_index)
+            self.emit("@R13\nA=M\nM=D\n")
+            return
+
+        self.write_load_d(src_segment, src_index)
+        self.write_store_d(dst_segment, dst_index)
+
+    def can_store_d(self, segment: str, index: int) -> bool:
+        """Whether write_store_d can reach segment[index] without using D
+        for the address."""
+        return not (segment in self.segment_map and int(index) > 1)
+
+    def write_store_d(self, segment: str, index: int) -> None:
+        """Writes assembly code that stores the D register into
+        segment[index], for targets that pass can_store_d.
+
+        Args:
+            segment (str): the memory segment to write to.
+            index (int): the index in the memory segment.
+        """
+        if segment in self.segment_map:
+            offset = "+1" if index == 1 else ""
+            self.emit(f"@{self.segment_map[segment]}\n"
+                      f"A=M{offset}\nM=D\n")
+        elif segment == "temp":
+            self.emit(f"@{5 + int(index)}\nM=D\n")
+        elif segment == "static":
+            self.emit(f"@{self.file_name}.{index}\nM=D\n")
+        elif segment == "pointer":
+            self.emit(f"@{'THAT' if index == 1 else 'THIS'}\n"
+                      "M=D\n")
 
     def write_label(self, label: str) -> None:
-        self.output_stream.write(f"//label command {self.cur_func}${label}\n")
-        self.output_stream.write(f"({self.cur_func}${label})\n")
+        self.spill_top()
+        self.emit(f"//label command {self.cur_func}${label}\n")
+        self.emit(f"({self.cur_func}${label})\n")
 
     def initializebootstrap(self):
-        self.output_stream.write("@256\nD=A\n@SP\nM=D\n")
+        self.emit("@256\nD=A\n@SP\nM=D\n")
         self.write_call('Sys.init', 0)
+        if self.shared_calls:
+            self.write_shared_routines()
+        if self.shared_compare:
+            self.write_shared_compare()
+
+    def write_shared_compare(self) -> None:
+        """Writes the global comparison routine used by gt and lt when
+        shared_compare is on. Each entry point expects D = return address
+        and replaces the two topmost stack values with the result.
+
+        It keeps the overflow safety of write_gt_lt_eq: x - y is only
+        computed when x and y are both negative or both non-negative;
+        otherwise the sign of x alone decides. eq stays inline: it cannot
+        overflow and its 11 words are cheaper than a call.
+        """
+        routine = ""
+        for command, jump in (("gt", "JGT"), ("lt", "JLT")):
+            routine += (f"({SHARED_COMPARE[command]})\n"
+                        "@R15\nM=D\n"
+                        f"@{SHARED_COMPARE[command]}_TEST\nD=A\n@R14\nM=D\n"
+                        "@__VM_COMPARE\n0;JMP\n"
+                        f"({SHARED_COMPARE[command]}_TEST)\n"
+                        f"@__VM_TRUE\nD;{jump}\n@__VM_FALSE\n0;JMP\n")
+
+        # Sets D to a value with the sign of x - y, then jumps to R14
+        routine += ("(__VM_COMPARE)\n"
+                    "@SP\nAM=M-1\nD=M\n@__VM_COMPARE_Y_NEG\nD;JLT\n"
+                    "@SP\nA=M-1\nD=M\n@__VM_COMPARE_X_NEG\nD;JLT\n"
+                    "@SP\nA=M\nD=D-M\n@R14\nA=M\n0;JMP\n"
+                    "(__VM_COMPARE_X_NEG)\n"  # x < 0 <= y
+                    "D=-1\n@R14\nA=M\n0;JMP\n"
+                    "(__VM_COMPARE_Y_NEG)\n"
+                    "@SP\nA=M-1\nD=M\n@__VM_COMPARE_X_POS\nD;JGE\n"
+                    "@SP\nA=M\nD=D-M\n@R14\nA=M\n0;JMP\n"
+                    "(__VM_COMPARE_X_POS)\n"  # x >= 0 > y
+                    "D=1\n@R14\nA=M\n0;JMP\n")
+
+        # Result tails, returning to R15
+        routine += ("(__VM_FALSE)\n"
+                    "@SP\nA=M-1\nM=0\n@R15\nA=M\n0;JMP\n"
+                    "(__VM_TRUE)\n"
+                    "@SP\nA=M-1\nM=-1\n@R15\nA=M\n0;JMP\n")
+
+        self.emit(routine)
+        self.stats["shared_compare_words"] += count_instructions(routine)
+
+    def write_shared_comparison(self, command: str) -> None:
+        """Writes a gt or lt that calls the shared comparison routine.
+
+        Args:
+            command (str): "gt" or "lt".
+        """
+        label = f"{self.file_name}$cmp.{self.index_gt_lq}"
+        site = f"@{label}\nD=A\n@{SHARED_COMPARE[command]}\n0;JMP\n"
+        self.emit(site + f"({label})\n")
+        self.index_gt_lq += 1
+        self.stats["comparisons"] += 1
+        self.stats[f"{command}_comparisons"] += 1
+        self.stats["comparison_site_words"] += count_instructions(site)
+
+    def write_shared_routines(self) -> None:
+        """Writes the global call and return routines used by call sites and
+        returns when shared_calls is on. Sys.init never returns, so they are
+        placed right after the bootstrap.
+
+        The call routine expects D = return address, R13 = n_args and
+        R14 = the callee's address. The return routine takes no arguments.
+        """
+        routines = (f"({SHARED_CALL})\n"
+                    "@SP\nA=M\nM=D\n")
+        for i in ['LCL', 'ARG', 'THIS', 'THAT']:
+            routines += f"@{i}\nD=M\n@SP\nAM=M+1\nM=D\n"
+        routines += ("@SP\nMD=M+1\n@LCL\nM=D\n"
+                     "@R13\nD=D-M\n@5\nD=D-A\n@ARG\nM=D\n"
+                     "@R14\nA=M\n0;JMP\n")
+
+        routines += (f"({SHARED_RETURN})\n"
+                     "@LCL\nD=M\n@R13\nM=D\n"
+                     "@5\nA=D-A\nD=M\n@R14\nM=D\n"
+                     "@SP\nAM=M-1\nD=M\n@ARG\nA=M\nM=D\n"
+                     "@ARG\nD=M+1\n@SP\nM=D\n")
+        for i in ['THAT', 'THIS', 'ARG', 'LCL']:
+            routines += f"@R13\nAM=M-1\nD=M\n@{i}\nM=D\n"
+        routines += "@R14\nA=M\n0;JMP\n"
+
+        self.emit(routines)
+        self.stats["shared_routine_words"] += count_instructions(routines)
 
     def write_goto(self, label: str) -> None:
-        self.output_stream.write(f"//goto the {self.cur_func}${label}\n"
-                                 f"@{self.cur_func}${label}\n"
-                                 "0;JMP\n")
+        self.spill_top()
+        self.emit(f"//goto the {self.cur_func}${label}\n"
+                  f"@{self.cur_func}${label}\n"
+                  "0;JMP\n")
 
     def write_if(self, label: str) -> None:
-        self.output_stream.write(f"//if command {self.cur_func}${label}\n")
-        self.output_stream.write("@SP\nAM=M-1\nD=M\n"
-                                 f"@{self.cur_func}${label}\n"
-                                 "D;JNE\n")
+        self.emit(f"//if command {self.cur_func}${label}\n")
+        if self.top_in_d:
+            self.stats["top_reuses"] += 1
+            self.top_in_d = False
+        else:
+            self.emit("@SP\nAM=M-1\nD=M\n")
+        self.emit(f"@{self.cur_func}${label}\n"
+                  "D;JNE\n")
 
     def write_function(self, function_name: str, n_vars: int) -> None:
+        self.spill_top()
         self.cur_func = function_name
         self.lab = 0
-        self.output_stream.write(f"//func command {self.cur_func}\n")
-        self.output_stream.write(f"({self.cur_func})\n")
+        self.emit(f"//func command {self.cur_func}\n")
+        self.emit(f"({self.cur_func})\n")
         for _ in range(int(n_vars)):
-            self.output_stream.write("@SP\nA=M\nM=0\n"
-                                     "@R13\nM=D\n"
-                                     "@SP\nM=M+1\n")
-        self.output_stream.write("@R13\nM=0\n")
+            self.emit("@SP\nA=M\nM=0\n"
+                      "@R13\nM=D\n"
+                      "@SP\nM=M+1\n")
+        self.emit("@R13\nM=0\n")
 
 
 
     def write_call(self, function_name: str, n_args: int) -> None:
+        self.spill_top()
+        if self.shared_calls:
+            self.write_shared_call(function_name, n_args)
+            return
         label = f"ret.{self.lab}"
-        self.output_stream.write(f"//call command {self.cur_func}${label}\n")
-        self.output_stream.write(f"@{self.cur_func}${label}\nD=A\n@SP\nM=M+1\nA=M-1\nM=D\n")
+        self.emit(f"//call command {self.cur_func}${label}\n")
+        self.emit(f"@{self.cur_func}${label}\nD=A\n@SP\nM=M+1\nA=M-1\nM=D\n")
         for i in ['LCL', 'ARG', 'THIS', 'THAT']:
-            self.output_stream.write(f"@{i}\nD=M\n@SP\nM=M+1\nA=M-1\nM=D\n")
+            self.emit(f"@{i}\nD=M\n@SP\nM=M+1\nA=M-1\nM=D\n")
         cur = int(n_args) + 5
-        self.output_stream.write(f"@{cur}\nD=A\n@SP\nD=M-D\n@ARG\nM=D\n")
-        self.output_stream.write("@SP\nD=M\n@LCL\nM=D\n")
-        self.output_stream.write(f"@{function_name}\n0;JMP\n")
+        self.emit(f"@{cur}\nD=A\n@SP\nD=M-D\n@ARG\nM=D\n")
+        self.emit("@SP\nD=M\n@LCL\nM=D\n")
+        self.emit(f"@{function_name}\n0;JMP\n")
+        self.write_label(label)
+        self.lab += 1
+
+    def write_shared_call(self, function_name: str, n_args: int) -> None:
+        """Writes a call site that hands over to the shared call routine.
+
+        Args:
+            function_name (str): the function to call.
+            n_args (int): the number of arguments already pushed.
+        """
+        label = f"ret.{self.lab}"
+        n_args = int(n_args)
+        if n_args in (0, 1):
+            site = f"@R13\nM={n_args}\n"
+        else:
+            site = f"@{n_args}\nD=A\n@R13\nM=D\n"
+        site += (f"@{function_name}\nD=A\n@R14\nM=D\n"
+                 f"@{self.cur_func}${label}\nD=A\n"
+                 f"@{SHARED_CALL}\n0;JMP\n")
+        self.emit(f"//call command {self.cur_func}${label}\n")
+        self.emit(site)
         self.write_label(label)
         self.lab += 1
+        self.stats["calls"] += 1
+        self.stats["call_site_words"] += count_instructions(site)
 
     def help(self, num: int, where: str):
-        self.output_stream.write(f"@{num}\nD=A\n@R15\nD=M-D\nA=D\nD=M\n@{where}\nM=D\n")
+        self.emit(f"@{num}\nD=A\n@R15\nD=M-D\nA=D\nD=M\n@{where}\nM=D\n")
 
     def write_return(self) -> None:
-        self.output_stream.write("//return command \n")
-        self.output_stream.write("@LCL\nD=M\n@R15\nM=D\n")
+        self.spill_top()
+        if self.shared_calls:
+            self.emit("//return command \n"
+                      f"@{SHARED_RETURN}\n0;JMP\n")
+            self.stats["returns"] += 1
+            self.stats["return_words"] += 2
+            return
+        self.emit("//return command \n")
+        self.emit("@LCL\nD=M\n@R15\nM=D\n")
         self.help(5, 'R14')
-        self.output_stream.write("@SP\nD=A\n@ARG\nD=M+D\n@R13\nM=D\n"
-                                 "@SP\nAM=M-1\nD=M\n@R13\nA=M\nM=D\n@R13\nM=0\n")
-        self.output_stream.write("@ARG\nD=M\nD=D+1\n@SP\nM=D\n")
+        self.emit("@SP\nD=A\n@ARG\nD=M+D\n@R13\nM=D\n"
+                  "@SP\nAM=M-1\nD=M\n@R13\nA=M\nM=D\n@R13\nM=0\n")
+        self.emit("@ARG\nD=M\nD=D+1\n@SP\nM=D\n")
         self.help(1, 'THAT')
         self.help(2, 'THIS')
         self.help(3, 'ARG')
         self.help(4, 'LCL')
-        self.output_stream.write(f"@R14\nA=M\n0;JMP\n")
+        self.emit(f"@R14\nA=M\n0;JMP\n")
+
+    @staticmethod
+    def inline_call_return_words() -> typing.Tuple[int, int]:
+        """Returns the ROM words of one inline call and one inline return."""
+        call, ret = CodeWriter(io.StringIO()), CodeWriter(io.StringIO())
+        call.write_call("f", 2)
+        ret.write_return()
+        return call.word_count(), ret.word_count()
+
+    @staticmethod
+    def inline_comparison_words() -> typing.Dict[str, int]:
+        """Returns the ROM words of one inline gt and lt."""
+        words = {}
+        for command in SHARED_COMPARE:
+            writer = CodeWriter(io.StringIO())
+            writer.write_arithmetic(command)
+            words[command] = writer.word_count()
+        return words
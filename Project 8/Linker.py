@@ -0,0 +1,193 @@
+"""Relocatable VM objects, and the linker that combines them into a program.
+
+An object (.vmo) is one translated .vm file, stored as JSON:
+    name     the file name its statics are namespaced by
+    options  the code generation options the bootstrap has to match
+    exports  the functions it defines
+    imports  the functions it calls without defining them
+    labels   every label it defines -> its offset in words
+    statics  the static variables it uses
+    code     its assembly, one instruction or label per line
+    words    its encoded ROM words; a string stands for an A-instruction
+             whose symbol (a label or a static) is only known at link time
+
+Linking lays the objects out after a bootstrap object, gives every label
+its ROM address and every static a RAM address from 16 on (in order of
+first use, as the assembler would), and patches the symbolic words. The
+result is the same .hack that assembling the linked .asm would give.
+"""
+import io
+import os
+import re
+import sys
+import json
+import typing
+import argparse
+from CodeWriter import CodeWriter, to_instructions
+
+# The encoding tables come from the assembler
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "Project 6"))
+from Code import Code  # noqa: E402
+from SymbolTable import SymbolTable  # noqa: E402
+
+OBJECT_FORMAT = "vmo"
+OBJECT_VERSION = 1
+# Options that decide which shared routines the bootstrap must provide
+SHARED_OPTIONS = ("shared_calls", "shared_compare")
+STATIC_PATTERN = re.compile(r"[^.$]+\.\d+")  # Xxx.i
+VARIABLE_BASE = 16
+
+
+def make_object(name: str, asm: str,
+                options: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Turns the assembly of one translated file into an object.
+
+    Args:
+        name (str): the file name, without extension.
+        asm (str): the file's assembly, without bootstrap.
+        options (typing.Dict[str, typing.Any]): the CodeWriter options it
+            was translated with.
+
+    Returns:
+        typing.Dict[str, typing.Any]: the object.
+    """
+    predefined = SymbolTable().table
+    encoder = Code()
+    code, words, labels = [], [], {}
+    referenced = {}  # Symbols in order of first use
+    for instruction in to_instructions(asm):
+        if instruction.kind == "comment":
+            continue
+        code.append(instruction.text)
+        if instruction.kind == "L":
+            labels[instruction.text[1:-1]] = len(words)
+        elif instruction.kind == "A":
+            symbol = instruction.text[1:]
+            if symbol.isdigit():
+                words.append(int(symbol))
+            elif symbol in predefined:
+                words.append(predefined[symbol])
+            else:
+                words.append(symbol)
+                referenced[symbol] = None
+        else:
+            words.append(int(encoder.c_instruction(instruction.text), 2))
+
+    external = [symbol for symbol in referenced if symbol not in labels]
+    statics = [symbol for symbol in external if STATIC_PATTERN.fullmatch(symbol)]
+    return {
+        "format": OBJECT_FORMAT,
+        "version": OBJECT_VERSION,
+        "name": name,
+        "options": {option: bool(options.get(option)) for option in SHARED_OPTIONS},
+        "exports": [label for label in labels if "$" not in label],
+        "imports": [symbol for symbol in external if symbol not in statics],
+        "labels": labels,
+        "statics": statics,
+        "code": code,
+        "words": words,
+    }
+
+
+def write_object(object_path: str, vm_object: typing.Dict[str, typing.Any]) -> None:
+    with open(object_path, "w") as object_file:
+        json.dump(vm_object, object_file, separators=(",", ":"))
+
+
+def read_object(object_path: str) -> typing.Dict[str, typing.Any]:
+    with open(object_path, "r") as object_file:
+        vm_object = json.load(object_file)
+    if (vm_object.get("format") != OBJECT_FORMAT
+            or vm_object.get("version") != OBJECT_VERSION):
+        raise ValueError(f"{object_path} is not a version {OBJECT_VERSION} "
+                         f"VM object")
+    return vm_object
+
+
+def make_bootstrap(objects: typing.List[typing.Dict[str, typing.Any]]) \
+        -> typing.Dict[str, typing.Any]:
+    """Returns the bootstrap object, with the shared routines that any of the
+    objects relies on."""
+    options = {option: any(vm_object["options"][option] for vm_object in objects)
+               for option in SHARED_OPTIONS}
+    output = io.StringIO()
+    code_wr = CodeWriter(output, **options)
+    code_wr.initializebootstrap()
+    code_wr.flush()
+    return make_object("bootstrap", output.getvalue(), options)
+
+
+def link(objects: typing.List[typing.Dict[str, typing.Any]]) \
+        -> typing.Tuple[typing.List[int], typing.List[str]]:
+    """Links objects, in the given order, into one program.
+
+    Args:
+        objects (typing.List[typing.Dict[str, typing.Any]]): the objects.
+
+    Returns:
+        typing.Tuple[typing.List[int], typing.List[str]]: the ROM words and
+            the assembly of the program, bootstrap included.
+    """
+    objects = [make_bootstrap(objects)] + objects
+
+    addresses = {}
+    base = 0
+    for vm_object in objects:
+        for label, offset in vm_object["labels"].items():
+            if label in addresses:
+                raise ValueError(f"{label} is defined twice "
+                                 f"(again in {vm_object['name']})")
+            addresses[label] = base + offset
+        base += len(vm_object["words"])
+
+    for vm_object in objects:
+        missing = [symbol for symbol in vm_object["imports"]
+                   if symbol not in addresses]
+        if missing:
+            raise ValueError(f"{vm_object['name']} calls undefined "
+                             f"{', '.join(missing)}")
+
+    variables = {}
+    words = []
+    for vm_object in objects:
+        for word in vm_object["words"]:
+            if isinstance(word, str):
+                address = addresses.get(word)
+                if address is None:
+                    address = variables.setdefault(word, VARIABLE_BASE + len(variables))
+                word = address
+            words.append(word)
+    code = [line for vm_object in objects for line in vm_object["code"]]
+    return words, code
+
+
+def find_objects(paths: typing.List[str]) -> typing.List[str]:
+    """Expands directories to the .vmo files in them, in sorted order."""
+    object_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            object_paths += sorted(
+                os.path.join(path, file_name) for file_name in os.listdir(path)
+                if os.path.splitext(file_name)[1].lower() == ".vmo")
+        else:
+            object_paths.append(path)
+    return object_paths
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="VMlinker", usage="VMlinker <objects or directories> -o <output>")
+    arg_parser.add_argument("objects", nargs="+",
+                            help=".vmo files, or directories of them")
+    arg_parser.add_argument("-o", "--output", required=True,
+                            help="the program to write: .asm, or .hack")
+    args = arg_parser.parse_args()
+
+    words, code = link([read_object(object_path)
+                        for object_path in find_objects(args.objects)])
+    with open(args.output, "w") as output_file:
+        if os.path.splitext(args.output)[1].lower() == ".hack":
+            output_file.write("\n".join(f"{word:016b}" for word in words))
+        else:
+            output_file.write("\n".join(code) + "\n")
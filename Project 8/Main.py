@@ -5,11 +5,18 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import io
 import os
 import sys
+import json
 import typing
-from Parser import Parser
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from Parser import Parser, Command
 from CodeWriter import CodeWriter
+from Optimizer import Peephole, ConstantFolder, DeadFunctionEliminator, Inliner
+from TranslationCache import TranslationCache
 
 C_ARITHMETIC = "C_ARITHMETIC"
 C_PUSH = 'C_PUSH'
@@ -21,10 +28,70 @@ C_FUNCTION = 'C_FUNCTION'
 C_RETURN = 'C_RETURN'
 C_CALL = 'C_CALL'
 C_Label ='C_LABEL'
+C_MOVE = 'C_MOVE'
+
+
+def read_commands(parser: Parser, verbose: bool = False) -> typing.List[Command]:
+    """Reads every command of a file into a list of Command records.
+
+    Args:
+        parser (Parser): the parser of the file.
+        verbose (bool): if this is True, echoes every command to stderr.
+
+    Returns:
+        typing.List[Command]: the file's commands.
+    """
+    commands = []
+    while parser.hasMoreLines():
+
+        parser.advance()
+        if parser.current_instruction is None:
+            break
+        cur = parser.commandType()
+        if verbose:
+            print(parser.current_instruction, file=sys.stderr)
+        arg1 = parser.arg1() if cur != C_RETURN else None
+        arg2 = parser.arg2() if cur in {C_PUSH, C_POP, C_FUNCTION, C_CALL} else None
+        commands.append(Command(cur, arg1, arg2, parser.line_number()))
+    return commands
+
+
+def write_commands(code_wr: CodeWriter, commands: typing.List[Command]) -> None:
+    """Hands every command to the matching CodeWriter method."""
+    for command in commands:
+        cur, arg1, arg2 = command.type, command.arg1, command.arg2
+        code_wr.source_line = command.line
+        if cur in {C_PUSH, C_POP}:
+            code_wr.write_push_pop(cur, arg1, arg2)
+        elif cur == C_MOVE:
+            code_wr.write_move(arg1[0], arg1[1], arg2[0], arg2[1])
+        elif cur == C_CALL:
+            code_wr.write_call(arg1, arg2)
+        elif cur == C_FUNCTION:
+            code_wr.write_function(arg1, arg2)
+        elif cur == C_ARITHMETIC:
+            code_wr.write_arithmetic(arg1)
+        elif cur == C_IF:
+            code_wr.write_if(arg1)
+        elif cur == C_LABAL:
+            code_wr.write_label(arg1)
+
+        elif cur == C_GOTO:
+            code_wr.write_goto(arg1)
+
+
+        elif cur == C_RETURN:
+            code_wr.write_return()
+        elif cur == C_Label:
+            code_wr.write_label(arg1)
+
 
 def translate_file(
         input_file: typing.TextIO, output_file: typing.TextIO,
-        bootstrap: bool) -> None:
+        bootstrap: bool, peephole: typing.Optional[Peephole] = None,
+        folder: typing.Optional[ConstantFolder] = None,
+        commands: typing.Optional[typing.List[Command]] = None,
+        **options) -> CodeWriter:
     """Translates a single file.
 
     Args:
@@ -32,11 +99,20 @@ def translate_file(
         output_file (typing.TextIO): writes all output to this file.
         bootstrap (bool): if this is True, the current file is the
             first file we are translating.
+        peephole (Peephole): if given, optimizes the commands before
+            they are written.
+        folder (ConstantFolder): if given, folds constants before the
+            peephole pass.
+        commands (typing.List[Command]): the file's commands, if they
+            were already read (whole-program mode).
+        options: code generation options, passed on to CodeWriter.
+
+    Returns:
+        CodeWriter: the writer used, whose stats describe the output.
     """
     # Your code goes here!
 
-    code_wr = CodeWriter(output_file)
-    parser = Parser(input_file)
+    code_wr = CodeWriter(output_file, **options)
     input_filename, input_extension = os.path.splitext(os.path.basename(input_file.name))
     code_wr.set_file_name(input_filename)
 
@@ -44,32 +120,138 @@ def translate_file(
     if bootstrap:
        code_wr.initializebootstrap()
 
-    while parser.hasMoreLines():
+    if commands is None:
+        commands = read_commands(Parser(input_file), code_wr.verbose)
+    if folder:
+        commands = folder.optimize(commands)
+    if peephole:
+        commands = peephole.optimize(commands)
+    write_commands(code_wr, commands)
+    code_wr.spill_top()
+    code_wr.flush()
 
-        parser.advance()
-        cur = parser.commandType()
-        print(parser.lines)
-        if cur in {C_PUSH, C_POP}:
-            code_wr.write_push_pop(cur, parser.arg1(), parser.arg2())
-        elif cur == C_CALL:
-            code_wr.write_call( parser.arg1(), parser.arg2())
-        elif cur == C_FUNCTION:
-            code_wr.write_function(parser.arg1(), parser.arg2())
-        elif cur == C_ARITHMETIC:
-            code_wr.write_arithmetic(parser.arg1())
-        elif cur == C_IF:
-            code_wr.write_if(parser.arg1())
-        elif cur == C_LABAL:
-            code_wr.write_label(parser.arg1())
+    return code_wr
 
-        elif cur == C_GOTO:
-            code_wr.write_goto(parser.arg1())
 
+def translate_job(job: tuple) -> tuple:
+    """Translates one file into a string, for a worker process.
 
-        elif cur == C_RETURN:
-            code_wr.write_return()
-        elif cur == C_Label:
-            code_wr.write_label(parser.arg1())
+    Args:
+        job (tuple): (input path, bootstrap, peephole, folder, commands,
+            options), as for translate_file.
+
+    Returns:
+        tuple: the assembly, the CodeWriter stats and source map ranges, and
+            the passes used, whose counts the caller merges.
+    """
+    input_path, bootstrap, peephole, folder, commands, options = job
+    output_file = io.StringIO()
+    with open(input_path, 'r') as input_file:
+        code_wr = translate_file(input_file, output_file, bootstrap,
+                                 peephole=peephole, folder=folder,
+                                 commands=commands, **options)
+    return (output_file.getvalue(), code_wr.stats, code_wr.source_ranges(),
+            peephole, folder)
+
+
+def translate_object(
+        input_file: typing.TextIO, object_path: str,
+        peephole: typing.Optional[Peephole] = None,
+        folder: typing.Optional[ConstantFolder] = None,
+        commands: typing.Optional[typing.List[Command]] = None,
+        **options) -> CodeWriter:
+    """Translates a single file into a relocatable object (see Linker).
+
+    Args:
+        input_file (typing.TextIO): the file to translate.
+        object_path (str): the .vmo file to write.
+        peephole, folder, commands, options: as for translate_file.
+
+    Returns:
+        CodeWriter: the writer used, whose stats describe the output.
+    """
+    # Imported here: the linker needs the assembler of Project 6, which
+    # plain translation does not
+    import Linker
+    output_file = io.StringIO()
+    code_wr = translate_file(input_file, output_file, False, peephole=peephole,
+                             folder=folder, commands=commands, **options)
+    name = os.path.splitext(os.path.basename(input_file.name))[0]
+    Linker.write_object(object_path,
+                        Linker.make_object(name, output_file.getvalue(), options))
+    return code_wr
+
+
+def write_source_map(map_path: str,
+                     ranges: typing.List[typing.Dict[str, typing.Any]]) -> None:
+    """Writes a source map as JSON lines, one run of ROM words per line:
+    {"rom": first address, "words", "file", "line", "function"}.
+
+    Args:
+        map_path (str): the file to write.
+        ranges (typing.List[typing.Dict[str, typing.Any]]): the runs of all
+            files, in output order (see CodeWriter.source_ranges).
+    """
+    rom = 0
+    with open(map_path, 'w') as map_file:
+        for source in ranges:
+            map_file.write(json.dumps({"rom": rom, **source}) + "\n")
+            rom += source["words"]
+
+
+def report_shared_calls(stats: typing.Counter) -> None:
+    """Prints the ROM saved by the shared call/return routines."""
+    call_words, return_words = CodeWriter.inline_call_return_words()
+    inline = stats["calls"] * call_words + stats["returns"] * return_words
+    shared = (stats["call_site_words"] + stats["return_words"]
+              + stats["shared_routine_words"])
+    print(f"Shared calls: {stats['calls']} call sites, {stats['returns']} "
+          f"returns, {inline} words inline vs {shared} shared, "
+          f"saved {inline - shared} words", file=sys.stderr)
+
+
+def report_shared_compare(stats: typing.Counter) -> None:
+    """Prints the ROM and cycles saved by the shared comparison routine."""
+    inline_words = CodeWriter.inline_comparison_words()
+    site_words = stats["comparison_site_words"] // max(stats["comparisons"], 1)
+    inline = sum(stats[f"{command}_comparisons"] * words
+                 for command, words in inline_words.items())
+    shared = stats["comparison_site_words"] + stats["shared_compare_words"]
+    cycles = sorted({inline_cycles - shared_cycles
+                     for inline_cycles, shared_cycles
+                     in zip(CodeWriter.INLINE_COMPARE_CYCLES,
+                            CodeWriter.SHARED_COMPARE_CYCLES)})
+    print(f"Shared compare: {stats['comparisons']} comparisons, "
+          f"{inline} words inline vs {shared} shared, "
+          f"saved {inline - shared} words; per comparison "
+          f"{inline_words['gt'] - site_words} words and "
+          f"{'-'.join(map(str, cycles))} cycles saved", file=sys.stderr)
+
+
+def report_top_cache(stats: typing.Counter) -> None:
+    """Prints how often the stack top was used straight from D."""
+    print(f"Top-of-stack caching: {stats['top_reuses']} stack round trips "
+          f"skipped, {stats['top_spills']} spills to RAM", file=sys.stderr)
+
+
+def report_inlining(inliner: Inliner) -> None:
+    """Prints the inlined call sites and the cycles they save.
+
+    Inline calls, function entries and returns are straight-line code, so
+    their ROM words are also the cycles they take: each site saves its call,
+    return and function entry, less the temp moves added around the body.
+    """
+    call_words, return_words = CodeWriter.inline_call_return_words()
+    saved = 0
+    for function, n_locals, added in inliner.sites:
+        entry, glue = CodeWriter(io.StringIO()), CodeWriter(io.StringIO())
+        entry.write_function(function, n_locals)
+        write_commands(glue, added)
+        saved += (call_words + return_words + entry.word_count()
+                  - glue.word_count())
+    print(inliner.report(), file=sys.stderr)
+    print(f"  estimated {saved} cycles saved if every inlined site "
+          f"runs once", file=sys.stderr)
 
 
 if "__main__" == __name__:
@@ -78,9 +260,64 @@ if "__main__" == __name__:
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: VMtranslator <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    arg_parser = argparse.ArgumentParser(
+        prog="VMtranslator", usage="VMtranslator <input path> [options]")
+    arg_parser.add_argument("input_path")
+    arg_parser.add_argument(
+        "--shared-calls", action="store_true",
+        help="emit one global call and return routine instead of inlining")
+    arg_parser.add_argument(
+        "--shared-compare", action="store_true",
+        help="emit one global gt/lt routine instead of inlining")
+    arg_parser.add_argument(
+        "--cache-top", action="store_true",
+        help="keep the stack top in D between commands of a basic block")
+    arg_parser.add_argument(
+        "--peephole", action="store_true",
+        help="fuse push/pop pairs and drop no-op arithmetic before writing")
+    arg_parser.add_argument(
+        "--fold", action="store_true",
+        help="evaluate arithmetic on constant operands at translate time")
+    arg_parser.add_argument(
+        "--dce", action="store_true",
+        help="whole-program mode: drop functions unreachable from Sys.init")
+    arg_parser.add_argument(
+        "--inline", type=int, nargs="?", const=Inliner.DEFAULT_THRESHOLD,
+        metavar="SIZE",
+        help="whole-program mode: inline leaf functions of at most SIZE "
+             f"VM commands (default: {Inliner.DEFAULT_THRESHOLD})")
+    arg_parser.add_argument(
+        "--parallel", type=int, nargs="?", const=0, metavar="WORKERS",
+        help="translate the files in a process pool (default: one worker "
+             "per CPU)")
+    arg_parser.add_argument(
+        "--verbose", action="store_true",
+        help="echo every VM command to stderr and keep comments in the output")
+    arg_parser.add_argument(
+        "--source-map", action="store_true",
+        help="also write a .map file of the VM file, line and function "
+             "behind every ROM address (as assembled without --optimize)")
+    arg_parser.add_argument(
+        "--incremental", action="store_true",
+        help="only retranslate .vm files that changed since the last run, "
+             "reusing the rest from a cache next to the output")
+    arg_parser.add_argument(
+        "--objects", action="store_true",
+        help="write a relocatable .vm object per file, for Linker.py, "
+             "instead of one .asm")
+    args = arg_parser.parse_args()
+    if args.source_map and args.objects:
+        # Objects are relocated by the linker, so no ROM addresses exist yet
+        arg_parser.error("--source-map cannot be combined with --objects")
+    options = {"shared_calls": args.shared_calls,
+               "shared_compare": args.shared_compare,
+               "cache_top": args.cache_top,
+               "verbose": args.verbose,
+               "source_map": args.source_map}
+    peephole = Peephole() if args.peephole else None
+    folder = ConstantFolder() if args.fold else None
+
+    argument_path = os.path.abspath(args.input_path)
     if os.path.isdir(argument_path):
         files_to_translate = [
             os.path.join(argument_path, filename)
@@ -91,12 +328,98 @@ if "__main__" == __name__:
         files_to_translate = [argument_path]
         output_path, extension = os.path.splitext(argument_path)
     output_path += ".asm"
-    bootstrap = True
-    with open(output_path, 'w') as output_file:
+    # Sorted, so the output does not depend on the directory listing order
+    files_to_translate = sorted(
+        input_path for input_path in files_to_translate
+        if os.path.splitext(input_path)[1].lower() == ".vm")
+
+    # Whole-program mode reads every file before writing anything
+    program = {}
+    inliner = Inliner(args.inline) if args.inline is not None else None
+    eliminator = DeadFunctionEliminator() if args.dce else None
+    if inliner or eliminator:
         for input_path in files_to_translate:
-            filename, extension = os.path.splitext(input_path)
-            if extension.lower() != ".vm":
-                continue
             with open(input_path, 'r') as input_file:
-                translate_file(input_file, output_file, bootstrap)
-            bootstrap = False
+                program[input_path] = read_commands(Parser(input_file), args.verbose)
+    if inliner:
+        program = inliner.optimize(program)
+    if eliminator:
+        # After inlining, so functions inlined everywhere are dropped too
+        program = eliminator.optimize(program)
+
+    stats = collections.Counter()
+    ranges = []
+    cache = TranslationCache(output_path) if args.incremental else None
+    if args.objects:
+        for input_path in files_to_translate:
+            with open(input_path, 'r') as input_file:
+                stats += translate_object(
+                    input_file, os.path.splitext(input_path)[0] + ".vmo",
+                    peephole=peephole, folder=folder,
+                    commands=program.get(input_path), **options).stats
+    elif args.parallel is not None or cache:
+        # Every file is translated into a string of its own, by a worker or
+        # from the cache; the strings are joined in file order, the first
+        # one carrying the bootstrap. Each job gets fresh passes, whose
+        # counts are merged below.
+        jobs = [(input_path, i == 0, Peephole() if peephole else None,
+                 ConstantFolder() if folder else None,
+                 program.get(input_path), options)
+                for i, input_path in enumerate(files_to_translate)]
+        results = [None] * len(jobs)
+        if cache:
+            cache.load()
+            keys = [cache.job_key(job) for job in jobs]
+            results = [cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if args.parallel is not None and missing:
+            with ProcessPoolExecutor(
+                    max_workers=args.parallel or os.cpu_count() or 1) as executor:
+                translated = list(executor.map(
+                    translate_job, [jobs[i] for i in missing]))
+        else:
+            translated = [translate_job(jobs[i]) for i in missing]
+        for i, result in zip(missing, translated):
+            results[i] = result
+        if cache:
+            cache.save(dict(zip(keys, results)))
+        with open(output_path, 'w') as output_file:
+            for (text, file_stats, file_ranges,
+                 file_peephole, file_folder) in results:
+                output_file.write(text)
+                stats += file_stats
+                ranges += file_ranges
+                if peephole:
+                    peephole.merge(file_peephole)
+                if folder:
+                    folder.merge(file_folder)
+    else:
+        bootstrap = True
+        with open(output_path, 'w') as output_file:
+            for input_path in files_to_translate:
+                with open(input_path, 'r') as input_file:
+                    code_wr = translate_file(
+                        input_file, output_file, bootstrap, peephole=peephole,
+                        folder=folder, commands=program.get(input_path),
+                        **options)
+                stats += code_wr.stats
+                ranges += code_wr.source_ranges()
+                bootstrap = False
+    if args.source_map:
+        write_source_map(os.path.splitext(output_path)[0] + ".map", ranges)
+    if cache:
+        print(cache.report(), file=sys.stderr)
+    if args.shared_calls:
+        report_shared_calls(stats)
+    if args.shared_compare:
+        report_shared_compare(stats)
+    if args.cache_top:
+        report_top_cache(stats)
+    if inliner:
+        report_inlining(inliner)
+    if eliminator:
+        print(eliminator.report(), file=sys.stderr)
+    if folder:
+        print(folder.report(), file=sys.stderr)
+    if peephole:
+        print(peephole.report(), file=sys.stderr)
@@ -0,0 +1,372 @@
+"""VM-level optimization passes that run between Parser and CodeWriter.
+
+Every pass takes and returns a list of Parser.Command records. Windows never
+cross label, goto, if-goto, function, call or return commands, since those
+are the only points where control can enter or leave straight-line code.
+"""
+import typing
+import collections
+from Parser import Command
+
+# Binary operations for which "push constant 0" as the second operand leaves
+# the first operand unchanged
+ZERO_IDENTITY = {"add", "sub", "or"}
+# Unary operations that undo themselves when applied twice
+INVOLUTIONS = {"not", "neg"}
+
+# Constant folding, on signed 16-bit values (True is -1, False is 0)
+UNARY_OPERATIONS = {
+    "neg": lambda x: -x,
+    "not": lambda x: ~x,
+}
+BINARY_OPERATIONS = {
+    "add": lambda x, y: x + y,
+    "sub": lambda x, y: x - y,
+    "and": lambda x, y: x & y,
+    "or": lambda x, y: x | y,
+    "eq": lambda x, y: -1 if x == y else 0,
+    "gt": lambda x, y: -1 if x > y else 0,
+    "lt": lambda x, y: -1 if x < y else 0,
+}
+# Segments at fixed addresses, whose constant contents can be tracked
+TRACKED_SEGMENTS = {"temp", "static", "pointer"}
+# Stack effect of each arithmetic command
+STACK_EFFECT = {"neg": 0, "not": 0, "add": -1, "sub": -1, "and": -1, "or": -1,
+                "eq": -1, "gt": -1, "lt": -1}
+# Commands after which nothing is known about memory any more
+CONTROL_COMMANDS = {"C_LABEL", "C_LABAL", "C_GOTO", "C_IF", "C_FUNCTION",
+                    "C_CALL", "C_RETURN"}
+
+
+def to_word(value: int) -> int:
+    """Wraps an integer to a signed 16-bit value."""
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def split_functions(commands: typing.List[Command]) \
+        -> typing.List[typing.Tuple[typing.Optional[str], typing.List[Command]]]:
+    """Splits a file's commands into (function name, commands) pieces;
+    commands before the first function come under None."""
+    pieces = [(None, [])]
+    for command in commands:
+        if command.type == "C_FUNCTION":
+            pieces.append((command.arg1, []))
+        pieces[-1][1].append(command)
+    return [piece for piece in pieces if piece[1]]
+
+
+class Peephole:
+    """Fuses push/pop pairs into direct moves and drops no-op arithmetic.
+
+    Rules:
+        - push S i, pop D j  ->  move S i to D j (no stack traffic)
+        - push constant 0, add|sub|or  ->  nothing
+        - not, not / neg, neg  ->  nothing
+    """
+
+    def __init__(self) -> None:
+        # Function name -> VM commands eliminated in it
+        self.eliminated = collections.Counter()
+
+    def optimize(self, commands: typing.List[Command]) -> typing.List[Command]:
+        optimized = []
+        function = None
+        for command in commands:
+            if command.type == "C_FUNCTION":
+                function = command.arg1
+            optimized.append(command)
+            self._rewrite_tail(optimized, function)
+        return optimized
+
+    def _rewrite_tail(self, optimized: typing.List[Command],
+                      function: typing.Optional[str]) -> None:
+        # Apply the rules to the last two commands until none matches
+        while len(optimized) >= 2:
+            first, second = optimized[-2], optimized[-1]
+            if (first.type == "C_PUSH" and second.type == "C_POP"):
+                optimized[-2:] = [Command("C_MOVE", (first.arg1, first.arg2),
+                                          (second.arg1, second.arg2), first.line)]
+                self.eliminated[function] += 1
+            elif (first.type == "C_PUSH" and first.arg1 == "constant"
+                  and first.arg2 == 0 and second.type == "C_ARITHMETIC"
+                  and second.arg1 in ZERO_IDENTITY):
+                del optimized[-2:]
+                self.eliminated[function] += 2
+            elif (first.type == second.type == "C_ARITHMETIC"
+                  and first.arg1 == second.arg1 and first.arg1 in INVOLUTIONS):
+                del optimized[-2:]
+                self.eliminated[function] += 2
+            else:
+                return
+
+    def merge(self, other: "Peephole") -> None:
+        """Adds in the counts of a copy that ran elsewhere (e.g. in a
+        worker process)."""
+        self.eliminated += other.eliminated
+
+    def report(self) -> str:
+        lines = [f"Peephole: eliminated {sum(self.eliminated.values())} "
+                 f"VM commands"]
+        for function, count in sorted(self.eliminated.items(),
+                                      key=lambda item: (-item[1], str(item[0]))):
+            lines.append(f"  {function or '<top level>'}: {count}")
+        return "\n".join(lines)
+
+
+class ConstantFolder:
+    """Evaluates arithmetic on constant operands at translate time.
+
+    Arithmetic whose operands are all "push constant" commands is replaced
+    by a single push of the result, computed with 16-bit wraparound. Folded
+    constants may fall outside 0..32767; CodeWriter.write_load_d handles
+    those.
+
+    Constants are also propagated through the fixed-address segments (temp,
+    static, pointer): after "push constant c" / "pop temp i", a later
+    "push temp i" becomes "push constant c". What is known is forgotten at
+    every control command, and after any pop to local, argument, this or
+    that, since those can point anywhere in RAM.
+    """
+
+    def __init__(self) -> None:
+        self.folded = 0
+        self.propagated = 0
+
+    def optimize(self, commands: typing.List[Command]) -> typing.List[Command]:
+        optimized = []
+        known = {}  # (segment, index) -> constant value
+        for command in commands:
+            if command.type in CONTROL_COMMANDS:
+                known.clear()
+
+            elif command.type == "C_PUSH" and (command.arg1, command.arg2) in known:
+                command = Command("C_PUSH", "constant",
+                                  known[(command.arg1, command.arg2)], command.line)
+                self.propagated += 1
+
+            elif command.type == "C_POP":
+                if command.arg1 not in TRACKED_SEGMENTS:
+                    known.clear()
+                elif self._constant(optimized, 1):
+                    known[(command.arg1, command.arg2)] = optimized[-1].arg2
+                else:
+                    known.pop((command.arg1, command.arg2), None)
+
+            elif command.type == "C_ARITHMETIC":
+                if command.arg1 in UNARY_OPERATIONS and self._constant(optimized, 1):
+                    x = optimized.pop().arg2
+                    command = Command("C_PUSH", "constant",
+                                      to_word(UNARY_OPERATIONS[command.arg1](x)),
+                                      command.line)
+                    self.folded += 1
+                elif command.arg1 in BINARY_OPERATIONS and self._constant(optimized, 2):
+                    y = optimized.pop().arg2
+                    x = optimized.pop().arg2
+                    command = Command("C_PUSH", "constant",
+                                      to_word(BINARY_OPERATIONS[command.arg1](x, y)),
+                                      command.line)
+                    self.folded += 1
+
+            optimized.append(command)
+        return optimized
+
+    @staticmethod
+    def _constant(optimized: typing.List[Command], count: int) -> bool:
+        # Whether the last `count` commands all push constants
+        return len(optimized) >= count and all(
+            command.type == "C_PUSH" and command.arg1 == "constant"
+            for command in optimized[-count:])
+
+    def merge(self, other: "ConstantFolder") -> None:
+        """Adds in the counts of a copy that ran elsewhere (e.g. in a
+        worker process)."""
+        self.folded += other.folded
+        self.propagated += other.propagated
+
+    def report(self) -> str:
+        return (f"Constant folding: folded {self.folded} operations, "
+                f"propagated {self.propagated} constants")
+
+
+class DeadFunctionEliminator:
+    """Drops functions that cannot be reached from the bootstrap.
+
+    Works on the whole program at once: the call graph is built from the
+    call commands inside each function, across all files, and only the
+    functions reachable from the roots (Sys.init by default) are kept.
+    The VM has no indirect calls, so the graph is exact. A program that
+    defines none of the roots, e.g. a single file without a bootstrap, is
+    left alone rather than emptied.
+    """
+
+    def __init__(self, roots: typing.Iterable[str] = ("Sys.init",)) -> None:
+        self.roots = list(roots)
+        # (file name, function name, VM commands) of every removed function
+        self.removed = []
+        self.skipped = False
+
+    def optimize(self, program: typing.Dict[str, typing.List[Command]]) \
+            -> typing.Dict[str, typing.List[Command]]:
+        """Takes and returns a mapping of file name -> commands."""
+        calls = collections.defaultdict(set)
+        for commands in program.values():
+            for function, body in split_functions(commands):
+                calls[function].update(command.arg1 for command in body
+                                       if command.type == "C_CALL")
+        if not any(root in calls for root in self.roots):
+            self.skipped = True
+            return program
+
+        reachable = set()
+        pending = self.roots + list(calls[None])
+        while pending:
+            function = pending.pop()
+            if function not in reachable:
+                reachable.add(function)
+                pending.extend(calls[function])
+
+        optimized = {}
+        for file_name, commands in program.items():
+            kept = []
+            for function, body in split_functions(commands):
+                if function is None or function in reachable:
+                    kept.extend(body)
+                else:
+                    self.removed.append((file_name, function, len(body)))
+            optimized[file_name] = kept
+        return optimized
+
+    def report(self) -> str:
+        if self.skipped:
+            return (f"Dead functions: warning: no {' or '.join(self.roots)} "
+                    f"in the program, kept every function")
+        lines = [f"Dead functions: removed {len(self.removed)} functions, "
+                 f"{sum(count for _, _, count in self.removed)} VM commands"]
+        for file_name, function, count in self.removed:
+            lines.append(f"  {function} ({file_name}): {count} commands")
+        return "\n".join(lines)
+
+
+class Inliner:
+    """Substitutes the bodies of small leaf functions at their call sites.
+
+    Works on the whole program, like DeadFunctionEliminator. A function is
+    inlined when its body is straight-line code (no call, label or branch)
+    ending in its only return, leaves exactly one value on the stack, has at
+    most `threshold` commands and does not use temp itself. Leaf functions
+    cannot be recursive.
+
+    The expansion of "call f n" keeps the stack discipline of a real call:
+        - the arguments are popped into temp n-1 .. temp 0 and f's locals
+          start out as 0 in the temp slots after them;
+        - argument i and local j in the body are remapped to those slots;
+        - a pointer that the body pops is saved to a further temp slot and
+          restored after the body, as return would restore THIS/THAT.
+    The VM spec lets any call clobber temp, so the caller cannot tell the
+    difference. Functions that use static are only inlined in their own
+    file, since static names are per file.
+    """
+
+    DEFAULT_THRESHOLD = 8
+    SCRATCH_SLOTS = 8  # temp 0..7
+
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD) -> None:
+        self.threshold = threshold
+        # Function name -> call sites it was inlined at
+        self.inlined = collections.Counter()
+        # (function name, locals, commands added around the body) per site
+        self.sites = []
+
+    def optimize(self, program: typing.Dict[str, typing.List[Command]]) \
+            -> typing.Dict[str, typing.List[Command]]:
+        """Takes and returns a mapping of file name -> commands."""
+        candidates = {}
+        for file_name, commands in program.items():
+            for function, body in split_functions(commands):
+                if function is not None and self._inlinable(body):
+                    candidates[function] = (file_name, body[0].arg2, body[1:-1])
+
+        optimized = {}
+        for file_name, commands in program.items():
+            optimized[file_name] = []
+            for command in commands:
+                expansion = None
+                if command.type == "C_CALL" and command.arg1 in candidates:
+                    expansion = self._expand(file_name, command,
+                                             *candidates[command.arg1])
+                if expansion is None:
+                    optimized[file_name].append(command)
+                else:
+                    optimized[file_name].extend(expansion)
+        return optimized
+
+    def _inlinable(self, body: typing.List[Command]) -> bool:
+        # body[0] is the function command itself
+        inner = body[1:-1]
+        if (body[-1].type != "C_RETURN" or len(inner) > self.threshold
+                or any(command.type not in ("C_PUSH", "C_POP", "C_ARITHMETIC")
+                       or command.arg1 == "temp" for command in inner)):
+            return False
+        depth = 0
+        for command in inner:
+            if command.type == "C_PUSH":
+                depth += 1
+            elif command.type == "C_POP":
+                depth -= 1
+            else:
+                depth += STACK_EFFECT[command.arg1]
+            if depth < 0:
+                return False
+        return depth == 1
+
+    def _expand(self, file_name: str, call: Command, source_name: str,
+                n_locals: int, inner: typing.List[Command]) \
+            -> typing.Optional[typing.List[Command]]:
+        # The inlined commands for one call site, or None if it can't be done
+        n_args = call.arg2
+        pointers = sorted({command.arg2 for command in inner
+                           if command.type == "C_POP" and command.arg1 == "pointer"})
+        if n_args + n_locals + len(pointers) > self.SCRATCH_SLOTS:
+            return None
+        if any(command.arg1 == "argument" and command.arg2 >= n_args
+               or command.arg1 == "local" and command.arg2 >= n_locals
+               for command in inner if command.type != "C_ARITHMETIC"):
+            return None
+        if (file_name != source_name
+                and any(command.arg1 == "static" for command in inner)):
+            return None
+
+        # Everything is attributed to the line of the call it replaces
+        line = call.line
+        prologue = [Command("C_POP", "temp", i, line) for i in reversed(range(n_args))]
+        for j in range(n_locals):
+            prologue += [Command("C_PUSH", "constant", 0, line),
+                         Command("C_POP", "temp", n_args + j, line)]
+        saved = {pointer: n_args + n_locals + k for k, pointer in enumerate(pointers)}
+        epilogue = []
+        for pointer, slot in saved.items():
+            prologue += [Command("C_PUSH", "pointer", pointer, line),
+                         Command("C_POP", "temp", slot, line)]
+            epilogue += [Command("C_PUSH", "temp", slot, line),
+                         Command("C_POP", "pointer", pointer, line)]
+
+        body = []
+        for command in inner:
+            if command.arg1 == "argument":
+                command = command._replace(arg1="temp")
+            elif command.arg1 == "local":
+                command = command._replace(arg1="temp", arg2=n_args + command.arg2)
+            body.append(command._replace(line=line))
+
+        self.inlined[call.arg1] += 1
+        self.sites.append((call.arg1, n_locals, prologue + epilogue))
+        return prologue + body + epilogue
+
+    def report(self) -> str:
+        lines = [f"Inlining: {sum(self.inlined.values())} call sites, "
+                 f"{len(self.inlined)} functions (threshold {self.threshold})"]
+        for function, count in sorted(self.inlined.items(),
+                                      key=lambda item: (-item[1], item[0])):
+            lines.append(f"  {function}: {count}")
+        return "\n".join(lines)
@@ -1,3 +1,14 @@
+import typing
+
+
+class Command(typing.NamedTuple):
+    """One parsed VM command; arg1/arg2 are None where they do not apply,
+    line is the 1-based source line, if known."""
+    type: str
+    arg1: typing.Any = None
+    arg2: typing.Any = None
+    line: typing.Optional[int] = None
+
 
 class Parser:
     def __init__(self,file_path) -> None:
@@ -10,6 +21,9 @@ class Parser:
         return self.current_line < len(self.lines)
 
     def advance(self) -> None:
+        # Leaves current_instruction None if only blank or comment lines
+        # were left
+        self.current_instruction = None
         while self.hasMoreLines():
             line = self.lines[self.current_line].strip()
             self.current_line += 1
@@ -17,6 +31,10 @@ class Parser:
                 self.current_instruction = line.split("//")[0].strip()
                 break
 
+    def line_number(self) -> int:
+        """Returns the 1-based source line of the current command."""
+        return self.current_line
+
     def commandType(self) -> str:
         arithmetic_commands = {"add", "sub", "and", "or", "eq", "gt", "lt", "neg", "not"}
         command=self.current_instruction.split(" ")[0]
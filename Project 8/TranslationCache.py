@@ -0,0 +1,89 @@
+"""Per-output cache of translated .vm files, for incremental translation."""
+import os
+import json
+import pickle
+import typing
+import hashlib
+
+CACHE_VERSION = 1
+# The translator's own sources: a change to any of them invalidates the cache
+TRANSLATOR_SOURCES = ("Main.py", "Parser.py", "CodeWriter.py", "Optimizer.py")
+
+
+def translator_hash() -> str:
+    """Returns a hash of the translator's source files."""
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in TRANSLATOR_SOURCES:
+        with open(os.path.join(directory, name), "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """Keeps the translation of every .vm file next to the output, keyed by
+    a hash of everything the translation depends on.
+
+    Since comparison labels are namespaced by file, a file's assembly only
+    depends on its content, its name, whether it carries the bootstrap, the
+    options and the passes run. Whole-program passes (--dce, --inline) can
+    change a file's commands without touching the file, so those jobs are
+    keyed by the commands actually translated instead of the file bytes.
+    """
+
+    def __init__(self, output_path: str) -> None:
+        self.cache_path = output_path + ".cache"
+        self.translator = translator_hash()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        try:
+            with open(self.cache_path, "rb") as cache_file:
+                version, translator, entries = pickle.load(cache_file)
+        except FileNotFoundError:
+            return
+        except Exception:
+            # Unreadable, truncated, or pickled against classes that have
+            # since been renamed or moved: start cold and drop the file
+            try:
+                os.remove(self.cache_path)
+            except OSError:
+                pass
+            return
+        if version == CACHE_VERSION and translator == self.translator:
+            self.entries = entries
+
+    def job_key(self, job: tuple) -> str:
+        """Returns the cache key of a Main.translate_job job."""
+        input_path, bootstrap, peephole, folder, commands, options = job
+        digest = hashlib.sha1()
+        digest.update(json.dumps([os.path.basename(input_path), bootstrap,
+                                  peephole is not None, folder is not None,
+                                  sorted(options.items())]).encode())
+        if commands is None:
+            with open(input_path, "rb") as input_file:
+                digest.update(input_file.read())
+        else:
+            digest.update(pickle.dumps(commands))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> typing.Optional[tuple]:
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def save(self, entries: typing.Dict[str, tuple]) -> None:
+        """Replaces the cache with the given key -> translate_job result
+        entries, so files that are gone do not linger."""
+        self.entries = entries
+        with open(self.cache_path, "wb") as cache_file:
+            pickle.dump((CACHE_VERSION, self.translator, entries), cache_file)
+
+    def report(self) -> str:
+        return (f"Incremental: reused {self.hits} of {self.hits + self.misses} "
+                f"files, retranslated {self.misses}")
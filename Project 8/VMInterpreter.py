@@ -0,0 +1,464 @@
+"""Runs .vm programs directly, without translating them to Hack.
+
+The program is loaded into an indexed list of (opcode, x, y) operations:
+labels and function names are resolved to program indices, and every
+segment access to an address, at load time. Memory is the Hack RAM as the
+standard VM mapping lays it out (SP, LCL, ARG, THIS and THAT in RAM[0..4],
+temp in RAM[5..12], statics from RAM[16] on, the stack from RAM[256]), with
+16-bit words, so results can be read from the same addresses as on the CPU
+emulator. Statics get their addresses in order of first use, file by file,
+as the assembler would give them. The one difference: return addresses
+saved in a frame are program indices, not ROM addresses.
+
+A program ends when it runs past its last command or reaches a goto to
+itself (Sys.init's final loop). Directories that define Sys.init get the
+translator's bootstrap (SP = 256, call Sys.init). Other programs start with
+SP = 256 and LCL, ARG, THIS and THAT at 300, 400, 3000 and 3010, the bases
+the Project 7 tests use; --load sets RAM words before running.
+
+VM emulator test scripts (the *VME.tst files, e.g. Project 7/Tests) can be
+run directly, and are checked against their .cmp files.
+"""
+import os
+import re
+import sys
+import time
+import typing
+import argparse
+from Parser import Parser, Command
+from Main import read_commands
+
+WORD_MASK = 0xFFFF
+ADDRESS_MASK = 0x7FFF
+MEMORY_SIZE = 32768
+STACK_BASE = 256
+STATIC_BASE = 16
+STATIC_END = 256  # Statics beyond this would overlap the stack
+TEMP_BASE = 5
+POINTER_BASE = 3
+# SP, LCL, ARG, THIS and THAT of programs without a bootstrap
+DEFAULT_POINTERS = [STACK_BASE, 300, 400, 3000, 3010]
+# Segments addressed through a base pointer -> the pointer's address
+BASE_POINTERS = {"local": 1, "argument": 2, "this": 3, "that": 4}
+
+# Opcodes
+(PUSH_CONSTANT, PUSH_ADDRESS, PUSH_INDIRECT, POP_ADDRESS, POP_INDIRECT,
+ ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+ GOTO, IF_GOTO, HALT, FUNCTION, CALL, RETURN) = range(20)
+ARITHMETIC = {"add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT,
+              "lt": LT, "and": AND, "or": OR, "not": NOT}
+
+Operation = typing.Tuple[int, typing.Any, typing.Any]
+
+
+def read_program(path: str) -> typing.Dict[str, typing.List[Command]]:
+    """Reads a .vm file, or every .vm file of a directory in sorted order.
+
+    Returns:
+        typing.Dict[str, typing.List[Command]]: file name (without
+            extension) -> its commands.
+    """
+    if os.path.isdir(path):
+        vm_paths = sorted(os.path.join(path, file_name)
+                          for file_name in os.listdir(path)
+                          if os.path.splitext(file_name)[1].lower() == ".vm")
+    else:
+        vm_paths = [path]
+    program = {}
+    for vm_path in vm_paths:
+        with open(vm_path, 'r') as input_file:
+            name = os.path.splitext(os.path.basename(vm_path))[0]
+            program[name] = read_commands(Parser(input_file))
+    return program
+
+
+class VMInterpreter:
+    """Executes a VM program, given as file name -> commands.
+
+    Args:
+        files (typing.Dict[str, typing.List[Command]]): the program's files,
+            in the order their statics are allocated.
+        bootstrap (bool): if the program defines Sys.init, start by setting
+            SP to 256 and calling it, as the translated program does;
+            otherwise Sys.init is entered directly, like the VM emulator
+            does. Programs without Sys.init start at their first command.
+    """
+
+    def __init__(self, files: typing.Dict[str, typing.List[Command]],
+                 bootstrap: bool = True) -> None:
+        self.statics = {}  # (file name, index) -> address
+        self.functions = {}  # Function name -> program index
+        self.program = []
+        self.bootstrap = bootstrap
+        self.entry = 0
+        self.load(files)
+        self.ram = [0] * MEMORY_SIZE
+        if "Sys.init" not in self.functions:
+            self.ram[0:len(DEFAULT_POINTERS)] = DEFAULT_POINTERS
+        self.reset()
+
+    def load(self, files: typing.Dict[str, typing.List[Command]]) -> None:
+        has_init = any(command.type == "C_FUNCTION" and command.arg1 == "Sys.init"
+                       for commands in files.values() for command in commands)
+        if has_init:
+            # The bootstrap: call Sys.init, which never returns
+            self.program = [(CALL, "Sys.init", 0), (HALT, None, None)]
+        labels = {}
+        jumps = []  # (program index, label key) to resolve
+        for file_name, commands in files.items():
+            function = ""
+            for command in commands:
+                kind, arg1, arg2 = command.type, command.arg1, command.arg2
+                if kind == "C_LABEL":
+                    labels[(file_name, function, arg1)] = len(self.program)
+                    continue
+                if kind == "C_ARITHMETIC":
+                    operation = (ARITHMETIC[arg1], None, None)
+                elif kind == "C_PUSH":
+                    operation = self.push_operation(file_name, arg1, arg2)
+                elif kind == "C_POP":
+                    operation = self.pop_operation(file_name, arg1, arg2)
+                elif kind in ("C_GOTO", "C_IF"):
+                    jumps.append((len(self.program), (file_name, function, arg1)))
+                    operation = (GOTO if kind == "C_GOTO" else IF_GOTO, arg1, None)
+                elif kind == "C_FUNCTION":
+                    function = arg1
+                    if function in self.functions:
+                        raise ValueError(f"{function} is defined twice "
+                                         f"(again in {file_name})")
+                    self.functions[function] = len(self.program)
+                    operation = (FUNCTION, arg2, [0] * arg2)
+                elif kind == "C_CALL":
+                    operation = (CALL, arg1, arg2)
+                elif kind == "C_RETURN":
+                    operation = (RETURN, None, None)
+                else:
+                    raise ValueError(f"{file_name}.vm line {command.line}: "
+                                     f"unknown command")
+                self.program.append(operation)
+
+        for index, key in jumps:
+            if key not in labels:
+                raise ValueError(f"{key[0]}.vm: undefined label {key[2]}"
+                                 f"{' in ' + key[1] if key[1] else ''}")
+            target = labels[key]
+            opcode = self.program[index][0]
+            if opcode == GOTO and target == index:
+                opcode = HALT  # label X, goto X: the program's final loop
+            self.program[index] = (opcode, target, None)
+        for index, (opcode, name, n_args) in enumerate(self.program):
+            if opcode == CALL:
+                if name not in self.functions:
+                    raise ValueError(f"Call to undefined function {name}")
+                self.program[index] = (CALL, self.functions[name], n_args)
+        if has_init and not self.bootstrap:
+            self.entry = self.functions["Sys.init"]
+
+    def push_operation(self, file_name: str, segment: str, index: int) -> Operation:
+        if segment == "constant":
+            return (PUSH_CONSTANT, index & WORD_MASK, None)
+        if segment in BASE_POINTERS:
+            return (PUSH_INDIRECT, BASE_POINTERS[segment], index)
+        return (PUSH_ADDRESS, self.address(file_name, segment, index), None)
+
+    def pop_operation(self, file_name: str, segment: str, index: int) -> Operation:
+        if segment in BASE_POINTERS:
+            return (POP_INDIRECT, BASE_POINTERS[segment], index)
+        return (POP_ADDRESS, self.address(file_name, segment, index), None)
+
+    def address(self, file_name: str, segment: str, index: int) -> int:
+        """Returns the RAM address of a fixed segment entry."""
+        if segment == "temp":
+            return TEMP_BASE + index
+        if segment == "pointer":
+            return POINTER_BASE + index
+        if segment == "static":
+            address = self.statics.get((file_name, index))
+            if address is None:
+                address = STATIC_BASE + len(self.statics)
+                if address >= STATIC_END:
+                    raise ValueError(f"{file_name}.vm: more than "
+                                     f"{STATIC_END - STATIC_BASE} statics")
+                self.statics[(file_name, index)] = address
+            return address
+        raise ValueError(f"{file_name}.vm: cannot access segment {segment}")
+
+    def reset(self) -> None:
+        """Restarts the program; memory keeps its contents, apart from SP
+        when the bootstrap runs."""
+        self.pc = self.entry
+        self.steps = 0
+        self.halted = False
+        if self.bootstrap and "Sys.init" in self.functions:
+            self.ram[0] = STACK_BASE
+
+    def run(self, max_steps: typing.Optional[int] = None) -> int:
+        """Runs until the program ends or max_steps operations have run.
+
+        Returns:
+            int: the number of operations run by this call.
+        """
+        program, ram = self.program, self.ram
+        size = len(program)
+        pc, sp = self.pc, ram[0]
+        limit = max_steps if max_steps is not None else float("inf")
+        steps = 0
+
+        while steps < limit:
+            if pc >= size:
+                self.halted = True
+                break
+            opcode, x, y = program[pc]
+            pc += 1
+            steps += 1
+            if opcode == PUSH_CONSTANT:
+                ram[sp] = x
+                sp += 1
+            elif opcode == PUSH_INDIRECT:
+                ram[sp] = ram[(ram[x] + y) & ADDRESS_MASK]
+                sp += 1
+            elif opcode == PUSH_ADDRESS:
+                ram[sp] = ram[x]
+                sp += 1
+            elif opcode == POP_INDIRECT:
+                sp -= 1
+                ram[(ram[x] + y) & ADDRESS_MASK] = ram[sp]
+            elif opcode == POP_ADDRESS:
+                sp -= 1
+                ram[x] = ram[sp]
+            elif opcode == ADD:
+                sp -= 1
+                ram[sp - 1] = (ram[sp - 1] + ram[sp]) & WORD_MASK
+            elif opcode == SUB:
+                sp -= 1
+                ram[sp - 1] = (ram[sp - 1] - ram[sp]) & WORD_MASK
+            elif opcode == IF_GOTO:
+                sp -= 1
+                if ram[sp]:
+                    pc = x
+            elif opcode == GOTO:
+                pc = x
+            elif opcode == LT:
+                # Flipping the sign bit orders 16-bit words as signed values
+                sp -= 1
+                ram[sp - 1] = WORD_MASK if ram[sp - 1] ^ 0x8000 < ram[sp] ^ 0x8000 else 0
+            elif opcode == GT:
+                sp -= 1
+                ram[sp - 1] = WORD_MASK if ram[sp - 1] ^ 0x8000 > ram[sp] ^ 0x8000 else 0
+            elif opcode == EQ:
+                sp -= 1
+                ram[sp - 1] = WORD_MASK if ram[sp - 1] == ram[sp] else 0
+            elif opcode == CALL:
+                ram[sp] = pc
+                ram[sp + 1:sp + 5] = ram[1:5]
+                sp += 5
+                ram[1] = sp
+                ram[2] = sp - 5 - y
+                pc = x
+            elif opcode == FUNCTION:
+                ram[sp:sp + x] = y
+                sp += x
+            elif opcode == RETURN:
+                frame = ram[1]
+                pc = ram[frame - 5]
+                argument = ram[2]
+                ram[argument] = ram[sp - 1]
+                sp = argument + 1
+                ram[1:5] = ram[frame - 4:frame]
+            elif opcode == AND:
+                sp -= 1
+                ram[sp - 1] &= ram[sp]
+            elif opcode == OR:
+                sp -= 1
+                ram[sp - 1] |= ram[sp]
+            elif opcode == NOT:
+                ram[sp - 1] ^= WORD_MASK
+            elif opcode == NEG:
+                ram[sp - 1] = -ram[sp - 1] & WORD_MASK
+            else:  # HALT
+                pc -= 1
+                self.halted = True
+                break
+
+        self.pc = pc
+        ram[0] = sp
+        self.steps += steps
+        return steps
+
+    def load_ram(self, address: int, values: typing.List[int]) -> None:
+        for offset, value in enumerate(values):
+            self.ram[(address + offset) & ADDRESS_MASK] = value & WORD_MASK
+
+    def dump_ram(self, start: int, end: int) -> typing.List[int]:
+        """Returns RAM[start:end] as signed values."""
+        return [value - 0x10000 if value & 0x8000 else value
+                for value in self.ram[start:end]]
+
+
+# Test script names of the pointers, and RAM[i]
+SCRIPT_POINTERS = {"sp": 0, "local": 1, "argument": 2, "this": 3, "that": 4}
+RAM_PATTERN = re.compile(r"RAM\[(\d+)\]")
+OUTPUT_PATTERN = re.compile(r"(.+)%([BDSX])(\d+)\.(\d+)\.(\d+)")
+
+
+def script_address(name: str) -> int:
+    match = RAM_PATTERN.fullmatch(name)
+    if match:
+        return int(match.group(1))
+    if name in SCRIPT_POINTERS:
+        return SCRIPT_POINTERS[name]
+    raise ValueError(f"Unsupported variable {name}")
+
+
+def script_commands(text: str) -> typing.List[typing.List[str]]:
+    """Splits a test script into commands, each a list of words; a repeat
+    block becomes ["repeat", n, [its commands]]."""
+    text = re.sub(r"/\*.*?\*/", " ", text, flags=re.DOTALL)
+    text = re.sub(r"//[^\n]*", " ", text)
+    tokens = re.findall(r"[{}]|[,;]|[^\s,;{}]+", text)
+
+    def parse(position: int) -> typing.Tuple[list, int]:
+        commands, words = [], []
+        while position < len(tokens):
+            token = tokens[position]
+            position += 1
+            if token in (",", ";"):
+                if words:
+                    commands.append(words)
+                words = []
+            elif token == "{":
+                body, position = parse(position)
+                commands.append(words + [body])
+                words = []
+            elif token == "}":
+                break
+            else:
+                words.append(token)
+        if words:
+            commands.append(words)
+        return commands, position
+
+    return parse(0)[0]
+
+
+def run_script(script_path: str) -> typing.Tuple[bool, str]:
+    """Runs a VM emulator test script (load, set, repeat, vmstep,
+    output-list, output, compare-to) and compares its output.
+
+    Returns:
+        typing.Tuple[bool, str]: whether the output matched the compare
+            file (True if there is none), and the output.
+    """
+    directory = os.path.dirname(os.path.abspath(script_path))
+    with open(script_path, 'r') as script_file:
+        commands = script_commands(script_file.read())
+    interpreter = None
+    columns = []
+    compare_path = None
+    lines = []
+
+    def execute(script: typing.List[typing.List[str]]) -> None:
+        nonlocal interpreter, columns, compare_path
+        for command in script:
+            name, arguments = command[0], command[1:]
+            if name == "load":
+                path = os.path.join(directory, arguments[0]) if arguments else directory
+                interpreter = VMInterpreter(read_program(path), bootstrap=False)
+            elif name == "compare-to":
+                compare_path = os.path.join(directory, arguments[0])
+            elif name == "output-file":
+                pass  # The output is returned instead
+            elif name == "output-list":
+                columns = [OUTPUT_PATTERN.fullmatch(column).groups()
+                           for column in arguments]
+                lines.append("|" + "|".join(
+                    variable[:int(left) + int(width) + int(right)].center(
+                        int(left) + int(width) + int(right))
+                    for variable, _, left, width, right in columns) + "|")
+            elif name == "set":
+                interpreter.ram[script_address(arguments[0])] = int(arguments[1]) & WORD_MASK
+            elif name == "repeat" and arguments[1] == [["vmstep"]]:
+                interpreter.run(int(arguments[0]))
+            elif name == "repeat":
+                for _ in range(int(arguments[0])):
+                    execute(arguments[1])
+                    if interpreter.halted:
+                        break
+            elif name == "vmstep":
+                interpreter.run(1)
+            elif name == "output":
+                values = []
+                for variable, _, left, width, right in columns:
+                    address = script_address(variable)
+                    value = interpreter.dump_ram(address, address + 1)[0]
+                    values.append(" " * int(left) + str(value).rjust(int(width))
+                                  + " " * int(right))
+                lines.append("|" + "|".join(values) + "|")
+            elif name == "echo":
+                pass
+            else:
+                raise ValueError(f"{script_path}: unsupported command {name}")
+
+    execute(commands)
+    output = "\n".join(lines)
+    if compare_path is None:
+        return True, output
+    with open(compare_path, 'r') as compare_file:
+        expected = [line.strip() for line in compare_file.read().splitlines() if line.strip()]
+    return [line.strip() for line in lines] == expected, output
+
+
+def parse_load(text: str) -> typing.Tuple[int, typing.List[int]]:
+    # "ADDRESS=V1,V2,..." -> (address, [values])
+    address, _, values = text.partition("=")
+    return int(address), [int(value) for value in values.split(",") if value]
+
+
+def parse_range(text: str) -> typing.Tuple[int, int]:
+    # "START:END" (end exclusive) or a single address
+    start, _, end = text.partition(":")
+    return int(start), int(end) if end else int(start) + 1
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="VMinterpreter", usage="VMinterpreter <paths> [options]")
+    arg_parser.add_argument("paths", nargs="+",
+                            help="a .vm file or directory to run, or VM "
+                                 "emulator test scripts (.tst) to check")
+    arg_parser.add_argument("--steps", type=int,
+                            help="stop after this many VM operations")
+    arg_parser.add_argument("--load", action="append", default=[],
+                            metavar="ADDRESS=V1,V2,...",
+                            help="set RAM words before running (repeatable)")
+    arg_parser.add_argument("--dump", action="append", default=[],
+                            metavar="START:END",
+                            help="print RAM words after running (repeatable)")
+    args = arg_parser.parse_args()
+
+    failed = False
+    for path in args.paths:
+        start = time.perf_counter()
+        if os.path.splitext(path)[1].lower() == ".tst":
+            passed, _ = run_script(path)
+            failed = failed or not passed
+            print(f"{path}: {'passed' if passed else 'FAILED'} "
+                  f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+            continue
+        try:
+            interpreter = VMInterpreter(read_program(path))
+        except ValueError as error:
+            sys.exit(str(error))
+        for text in args.load:
+            interpreter.load_ram(*parse_load(text))
+        steps = interpreter.run(args.steps)
+        seconds = time.perf_counter() - start
+        for text in args.dump:
+            start_address, end_address = parse_range(text)
+            for address, value in enumerate(
+                    interpreter.dump_ram(start_address, end_address), start_address):
+                print(f"RAM[{address}] = {value}")
+        print(f"{path}: {steps} operations in {seconds:.3f} s, "
+              f"{'halted' if interpreter.halted else 'stopped'}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
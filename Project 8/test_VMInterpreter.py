@@ -0,0 +1,32 @@
+import os
+import sys
+import subprocess
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TESTS = os.path.join(HERE, os.pardir, "Project 7", "Tests")
+
+
+def run_interpreter(*arguments):
+    """Runs VMInterpreter.py and returns its stdout."""
+    result = subprocess.run(
+        [sys.executable, os.path.join(HERE, "VMInterpreter.py"), *arguments],
+        capture_output=True, text=True, check=True, cwd=HERE)
+    return result.stdout
+
+
+class VMInterpreterCLITest(unittest.TestCase):
+    def test_simple_add_without_bootstrap(self):
+        output = run_interpreter(os.path.join(TESTS, "SimpleAdd", "SimpleAdd.vm"),
+                                 "--dump", "0", "--dump", "256")
+        self.assertIn("RAM[0] = 257", output)
+        self.assertIn("RAM[256] = 15", output)
+
+    def test_load_moves_the_stack(self):
+        output = run_interpreter(os.path.join(TESTS, "SimpleAdd", "SimpleAdd.vm"),
+                                 "--load", "0=400", "--dump", "400")
+        self.assertIn("RAM[400] = 15", output)
+
+
+if __name__ == "__main__":
+    unittest.main()